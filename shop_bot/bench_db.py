@@ -0,0 +1,115 @@
+"""Нагрузочное сравнение доступа к базе: блокирующий sqlite3 в обработчиках и AsyncDatabase.
+
+Имитируется просмотр товара (товар, признак «в избранном», список товаров категории) множеством
+одновременных обработчиков. Параллельно работает «пульс» цикла событий: по его максимальной
+задержке видно, насколько запросы к базе блокируют обработку остальных обновлений.
+База - копия db/shop.db во временном каталоге, заполненная тестовыми товарами.
+
+Запуск: python bench_db.py [число_обработчиков] [одновременно] [товаров]
+"""
+import asyncio
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), "shop.db")
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:benchmark")
+os.environ["SHOP_DB"] = DB_FILE
+
+CATEGORIES = 50
+USERS = 1000
+
+
+def fill_database(products: int):
+    """Создает копию базы магазина с тестовыми категориями, товарами и избранным."""
+    shutil.copy("db/shop.db", DB_FILE)
+    conn = sqlite3.connect(DB_FILE)
+    conn.executemany("INSERT INTO categories (name) VALUES (?)", [(f"Категория {i}",) for i in range(CATEGORIES)])
+    conn.executemany(
+        "INSERT INTO products (category_id, name, description, price, seller_contacts) VALUES (?, ?, ?, ?, ?)",
+        [(i % CATEGORIES + 1, f"Товар {i}", "Описание товара " * 10, 100 + i, "@seller") for i in range(products)]
+    )
+    conn.executemany("INSERT INTO favorites (id) VALUES (?)", [(i,) for i in range(1, USERS + 1)])
+    conn.executemany("INSERT INTO users (id, favorite_id) VALUES (?, ?)", [(i, i) for i in range(1, USERS + 1)])
+    conn.executemany(
+        "INSERT INTO favorite_items (favorite_id, product_id) VALUES (?, ?)",
+        [(random.randint(1, USERS), random.randint(1, products)) for _ in range(USERS * 5)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def product_view_queries(user_id, product_id, category):
+    """Запросы, которые выполняются при просмотре товара."""
+    return (
+        ("SELECT products.name, description, price, image_url, seller_contacts, categories.name AS category_name "
+         "FROM products JOIN categories ON products.category_id = categories.id WHERE products.id = ?", (product_id,)),
+        ("SELECT favorite_id FROM users WHERE id = ?", (user_id,)),
+        ("SELECT 1 FROM favorite_items WHERE favorite_id = ? AND product_id = ?", (user_id, product_id)),
+        ("SELECT products.id, products.name FROM products JOIN categories ON products.category_id = categories.id "
+         "WHERE categories.name = ?", (category,)),
+    )
+
+
+def blocking_product_view(user_id, product_id, category):
+    """Просмотр товара как раньше: sqlite3.connect()/close() на каждый запрос прямо в обработчике."""
+    for sql, params in product_view_queries(user_id, product_id, category):
+        conn = sqlite3.connect(DB_FILE)
+        conn.row_factory = sqlite3.Row
+        conn.execute(sql, params).fetchall()
+        conn.close()
+
+
+async def run(name: str, view, handlers: int, concurrency: int, products: int):
+    stall = 0.0
+    done = False
+
+    async def heartbeat():
+        nonlocal stall
+        while not done:
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            stall = max(stall, time.perf_counter() - started - 0.001)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def handler():
+        async with semaphore:
+            await view(random.randint(1, USERS), random.randint(1, products), f"Категория {random.randrange(CATEGORIES)}")
+
+    pulse = asyncio.create_task(heartbeat())
+    started = time.perf_counter()
+    await asyncio.gather(*(handler() for _ in range(handlers)))
+    elapsed = time.perf_counter() - started
+    done = True
+    await pulse
+    print(f"{name:>10}: {handlers / elapsed:7.0f} обработчиков/с, максимальная задержка цикла событий {stall * 1000:6.1f} мс")
+
+
+async def main():
+    handlers = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    products = int(sys.argv[3]) if len(sys.argv) > 3 else 10000
+    fill_database(products)
+
+    import shop_async
+
+    async def blocking_view(user_id, product_id, category):
+        blocking_product_view(user_id, product_id, category)
+
+    async def async_view(user_id, product_id, category):
+        # По одному запросу за раз, как в обработчике shop_async: параллелизм дают только одновременные обработчики
+        for sql, params in product_view_queries(user_id, product_id, category):
+            await shop_async.db.fetchall(sql, params)
+
+    await run("blocking", blocking_view, handlers, concurrency, products)
+    await run("async", async_view, handlers, concurrency, products)
+    shop_async.db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
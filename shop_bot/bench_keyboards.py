@@ -0,0 +1,87 @@
+"""Микробенчмарк клавиатур каталога: сборка на каждый запрос и готовые клавиатуры из кэша снимка.
+
+Для каждой клавиатуры измеряется время одного запроса и память, выделяемая за запрос (tracemalloc).
+Для shop_bot.py в запрос входит и сериализация в JSON, которую telebot выполняет при каждой отправке.
+База - копия db/shop.db во временном каталоге, заполненная тестовыми товарами (см. bench_db.py).
+
+Запуск: python bench_keyboards.py [повторов] [товаров]
+"""
+import sqlite3
+import sys
+import time
+import tracemalloc
+
+from bench_db import DB_FILE, fill_database  # Импорт направляет SHOP_DB ботов во временную базу
+
+
+def measure(fn, repeats: int):
+    """Возвращает среднее время (мкс) и средний пик выделенной памяти (байт) на один вызов fn()."""
+    fn()  # Первый вызов заполняет кэш и не учитывается
+    started = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    elapsed = (time.perf_counter() - started) / repeats
+
+    calls = max(repeats // 10, 1)
+    allocated = 0
+    tracemalloc.start()
+    for _ in range(calls):
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        allocated += peak - before  # Пик памяти за вызов: временные объекты тоже учитываются
+    tracemalloc.stop()
+    return elapsed * 1e6, allocated / calls
+
+
+def compare(name: str, build, cached, repeats: int):
+    build_time, build_bytes = measure(build, repeats)
+    cached_time, cached_bytes = measure(cached, repeats)
+    print(f"{name:>28}: сборка {build_time:9.1f} мкс {build_bytes / 1024:8.1f} КиБ | "
+          f"кэш {cached_time:6.2f} мкс {cached_bytes / 1024:6.2f} КиБ | "
+          f"быстрее в {build_time / cached_time:,.0f} раз")
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    products = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    fill_database(products)
+
+    import shop_async
+    import shop_bot
+    from shop_catalog import load_snapshot
+    from shop_migrations import migrate
+
+    conn = sqlite3.connect(DB_FILE)
+    migrate(conn)
+    snapshot = load_snapshot(conn)
+    conn.close()
+    category = "Категория 0"
+    page = snapshot.product_page(category, 0, shop_async.PRODUCTS_PAGE_SIZE)
+    print(f"Категорий: {len(snapshot.categories)}, товаров в категории: {len(snapshot.products_by_category[category])}, "
+          f"на странице: {len(page.products)}")
+
+    compare("aiogram: категории",
+            lambda: shop_async.build_categories_keyboard(snapshot),
+            lambda: snapshot.markup("categories", shop_async.build_categories_keyboard), repeats)
+    compare("aiogram: inline-категории",
+            lambda: shop_async.build_inline_categories_keyboard(snapshot),
+            lambda: snapshot.markup("inline_categories", shop_async.build_inline_categories_keyboard), repeats)
+    compare("aiogram: товары категории",
+            lambda: shop_async.build_products_keyboard(snapshot, category, page),
+            lambda: snapshot.markup(("products", category, 0), shop_async.build_products_keyboard, category, page), repeats)
+
+    snapshot.markups.clear()  # Ключи клавиатур у ботов совпадают, каждый бот держит свой каталог
+    compare("telebot: категории",
+            lambda: shop_bot.build_categories_keyboard(snapshot).to_json(),
+            lambda: snapshot.markup("categories", shop_bot.build_categories_keyboard).to_json(), repeats)
+    compare("telebot: товары категории",
+            lambda: shop_bot.build_products_keyboard(snapshot, category, page).to_json(),
+            lambda: snapshot.markup(("products", category, 0), shop_bot.build_products_keyboard, category, page).to_json(),
+            repeats)
+    shop_async.db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""Скорость полнотекстового поиска товаров (FTS5) на большом каталоге.
+
+База - копия db/shop.db во временном каталоге, заполненная тестовыми товарами (см. bench_db.py).
+
+Запуск: python bench_search.py [товаров] [повторов]
+"""
+import sqlite3
+import sys
+import time
+
+from bench_db import DB_FILE, fill_database
+from shop_migrations import migrate
+from shop_search import search_product_ids
+
+QUERIES = ["Т", "То", "Товар", "Товар 4242", "товар 99", "описание", "нет такого"]
+
+
+def main():
+    products = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    fill_database(products)
+
+    conn = sqlite3.connect(DB_FILE)
+    started = time.perf_counter()
+    migrate(conn)  # Миграция строит индекс по всем товарам
+    print(f"Товаров: {products}, построение индекса: {time.perf_counter() - started:.2f} с")
+
+    for query in QUERIES:
+        found = len(search_product_ids(conn, query))
+        started = time.perf_counter()
+        for _ in range(repeats):
+            search_product_ids(conn, query)
+        elapsed = (time.perf_counter() - started) / repeats
+        print(f"{query!r:>14}: {elapsed * 1000:7.2f} мс, найдено {found}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,21 @@
 import asyncio
 import os
+from typing import Tuple
 from dotenv import load_dotenv
-import sqlite3
+from pydantic import ConfigDict, field_serializer
 
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import CommandStart
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardButton
+from aiogram.filters import CommandStart, Command, CommandObject
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.types import InlineQueryResultArticle, InputTextMessageContent
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+from shop_db import AsyncDatabase, ConnectionPool, DB_PATH, POOL_SIZE
+from shop_catalog import Catalog, CHECK_INTERVAL, PAGE_SIZE
+from shop_migrations import migrate
+from shop_favorites import FavoritesWriter, BATCH_WINDOW
+from shop_search import search_product_ids, SEARCH_LIMIT
+
 # Загружаем переменные окружения из .env файла
 load_dotenv()
 
@@ -18,24 +26,83 @@ if not BOT_TOKEN:
     print("Ошибка: Необходима переменная окружения TELEGRAM_BOT_TOKEN.")
     exit()
 
+# Настройки базы данных (можно переопределить через .env)
+SHOP_DB = os.environ.get("SHOP_DB", DB_PATH)
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", POOL_SIZE))
+CATALOG_CHECK_INTERVAL = float(os.environ.get("CATALOG_CHECK_INTERVAL", CHECK_INTERVAL))  # Как часто сверять версию каталога, с
+PRODUCTS_PAGE_SIZE = int(os.environ.get("PRODUCTS_PAGE_SIZE", PAGE_SIZE))  # Товаров на странице списка категории
+SEARCH_RESULTS = int(os.environ.get("SEARCH_RESULTS", SEARCH_LIMIT))  # Сколько товаров показывать в результатах поиска
+SEARCH_CACHE_TIME = int(os.environ.get("SEARCH_CACHE_TIME", 30))  # Сколько секунд Telegram кэширует ответ на inline-запрос
+INLINE_DEBOUNCE = float(os.environ.get("INLINE_DEBOUNCE", 0.4))  # Пауза после ввода, прежде чем искать, с
+FAVORITES_BATCH_WINDOW = float(os.environ.get("FAVORITES_BATCH_WINDOW", BATCH_WINDOW))  # Сколько собирать изменения избранного в одну транзакцию, с
+
 bot = Bot(token=BOT_TOKEN)
 dp = Dispatcher()
 
-def get_db_connection():
-    conn = sqlite3.connect('db/shop.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+# Пул соединений с базой: соединения открываются и настраиваются один раз при старте.
+# Запросы выполняются в отдельных потоках, чтобы не блокировать цикл событий.
+db_pool = ConnectionPool(SHOP_DB, DB_POOL_SIZE)
+db = AsyncDatabase(db_pool)
 
-def get_categories():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT name FROM categories")
-    categories = [row[0] for row in cursor.fetchall()]
-    conn.close()
-    return categories
+# Схема базы (индексы, таблица версии каталога) обновляется при старте
+with db_pool.connection() as conn:
+    migrate(conn)
+
+# Каталог (категории и товары) в памяти: перечитывается, только когда его версия в базе изменилась
+catalog = Catalog(CATALOG_CHECK_INTERVAL)
+
+# Изменения избранного записываются пачками в отдельном потоке
+favorites_writer = FavoritesWriter(SHOP_DB, FAVORITES_BATCH_WINDOW)
+
+inline_latest = {}  # id пользователя -> id его последнего inline-запроса (для debounce)
+
+async def get_catalog():
+    return catalog.fresh() or await db.run(catalog.get)
+
+async def get_categories():
+    return list((await get_catalog()).categories)
+
+async def get_product(product_id):
+    return (await get_catalog()).products.get(product_id)
+
+# Клавиатуры aiogram изменяемы (атрибуты можно присваивать, ряды кнопок - списки), а готовая
+# клавиатура каталога общая для всех пользователей. Поэтому в кэш попадает замороженная копия:
+# присваивание атрибутов запрещено, ряды - кортежи. В Telegram отправляется тот же JSON, что и раньше.
+class FrozenKeyboardButton(KeyboardButton):
+    model_config = ConfigDict(frozen=True)
+
+class FrozenInlineKeyboardButton(InlineKeyboardButton):
+    model_config = ConfigDict(frozen=True)
+
+class FrozenReplyKeyboardMarkup(ReplyKeyboardMarkup):
+    model_config = ConfigDict(frozen=True)
+    keyboard: Tuple[Tuple[FrozenKeyboardButton, ...], ...]
 
-def create_categories_keyboard():
-    categories = get_categories()
+    @field_serializer("keyboard")
+    def _rows_as_lists(self, rows):
+        return [list(row) for row in rows]  # aiogram при отправке разбирает только списки
+
+class FrozenInlineKeyboardMarkup(InlineKeyboardMarkup):
+    model_config = ConfigDict(frozen=True)
+    inline_keyboard: Tuple[Tuple[FrozenInlineKeyboardButton, ...], ...]
+
+    @field_serializer("inline_keyboard")
+    def _rows_as_lists(self, rows):
+        return [list(row) for row in rows]
+
+for frozen_type in (FrozenKeyboardButton, FrozenInlineKeyboardButton, FrozenReplyKeyboardMarkup, FrozenInlineKeyboardMarkup):
+    frozen_type.model_rebuild()  # Типы aiogram собираются отложенно (defer_build)
+
+FROZEN_MARKUPS = {ReplyKeyboardMarkup: FrozenReplyKeyboardMarkup, InlineKeyboardMarkup: FrozenInlineKeyboardMarkup}
+
+def freeze_markup(markup):
+    """Возвращает неизменяемую копию клавиатуры."""
+    return FROZEN_MARKUPS[type(markup)].model_validate(markup.model_dump(exclude_unset=True))
+
+# Клавиатуры каталога одинаковы для всех пользователей: они собираются один раз для каждой
+# версии каталога (snapshot.markup) и затем отдаются готовыми
+def build_categories_keyboard(snapshot):
+    categories = list(snapshot.categories)
     if "Избранное" in categories:
         categories.remove("Избранное")
     categories.insert(0, "Избранное")
@@ -47,95 +114,95 @@ def create_categories_keyboard():
         keyboard.append([KeyboardButton(text=category) for category in row])
 
     markup = ReplyKeyboardMarkup(resize_keyboard=True, keyboard=keyboard)
-    return markup
+    return freeze_markup(markup)
 
-def create_products_keyboard(category):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT products.id, products.name FROM products
-        JOIN categories ON products.category_id = categories.id
-        WHERE categories.name = ?
-    ''', (category,))
-    products = cursor.fetchall()
-    conn.close()
+async def create_categories_keyboard():
+    return (await get_catalog()).markup("categories", build_categories_keyboard)
+
+async def get_category_products(category):
+    return (await get_catalog()).products_by_category.get(category, ())
+
+def build_products_keyboard(snapshot, category, page):
+    category_id = snapshot.category_ids.get(category)
 
     builder = InlineKeyboardBuilder()
-    for product in products:
-        product_id = product['id']
-        product_name = product['name']
+    for product in page.products:
+        product_id = product.id
+        product_name = product.name
         button_text = f"{product_name} (ID: {product_id})"
         callback_data = f"show_product_{product_id}"
-        builder.add(InlineKeyboardButton(text=button_text, callback_data=callback_data))
-    builder.add(InlineKeyboardButton(text="Назад к категориям", callback_data="back_to_categories"))
-    builder.adjust(1)
-    return builder.as_markup()
-
-def create_inline_categories_keyboard():
-    categories = get_categories()
+        builder.row(InlineKeyboardButton(text=button_text, callback_data=callback_data))
+    # Переход по страницам: в callback_data - id категории и id последнего товара перед страницей
+    navigation = []
+    if page.prev_after is not None:
+        navigation.append(InlineKeyboardButton(text=f"« {page.number - 1}", callback_data=f"products_page_{category_id}_{page.prev_after}"))
+    if page.next_after is not None:
+        navigation.append(InlineKeyboardButton(text=f"{page.number + 1} »", callback_data=f"products_page_{category_id}_{page.next_after}"))
+    if navigation:
+        builder.row(*navigation)
+    builder.row(InlineKeyboardButton(text="Назад к категориям", callback_data="back_to_categories"))
+    return freeze_markup(builder.as_markup())
+
+async def create_products_keyboard(category, after_id=0):
+    snapshot = await get_catalog()
+    if category not in snapshot.products_by_category:
+        category = None  # Для неизвестных категорий клавиатура одна (только «Назад»), кэш не растет
+    page = snapshot.product_page(category, after_id, PRODUCTS_PAGE_SIZE)
+    if page.start % PRODUCTS_PAGE_SIZE:
+        # Страница со сдвигом (каталог изменился после показа списка) собирается без кэша
+        return build_products_keyboard(snapshot, category, page)
+    return snapshot.markup(("products", category, page.start), build_products_keyboard, category, page)
+
+def build_inline_categories_keyboard(snapshot):
     builder = InlineKeyboardBuilder()
-    for category in categories:
+    for category in snapshot.categories:
         builder.add(InlineKeyboardButton(text=category, callback_data=f"category_selected_{category}"))
     builder.adjust(1)
-    return builder.as_markup()
+    return freeze_markup(builder.as_markup())
 
-def get_or_create_user_favorites(user_id):
-    conn = get_db_connection()
+async def create_inline_categories_keyboard():
+    return (await get_catalog()).markup("inline_categories", build_inline_categories_keyboard)
+
+# Функции с параметром conn выполняются в потоке БД (через db.run), остальные - в цикле событий
+def get_or_create_user_favorites(conn, user_id):
     cursor = conn.cursor()
 
     cursor.execute("SELECT favorite_id FROM users WHERE id = ?", (user_id,))
     result = cursor.fetchone()
 
     if result:
-        favorite_id = result[0]
-        conn.close()
-        return favorite_id
-    else:
-        cursor.execute("INSERT INTO favorites DEFAULT VALUES")
-        favorite_id = cursor.lastrowid
+        return result[0]
 
-        cursor.execute("INSERT INTO users (id, favorite_id) VALUES (?, ?)", (user_id, favorite_id))
-        conn.commit()
-        conn.close()
-        return favorite_id
+    cursor.execute("INSERT INTO favorites DEFAULT VALUES")
+    favorite_id = cursor.lastrowid
 
-def add_to_favorites(user_id, product_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    favorite_id = get_or_create_user_favorites(user_id)
+    cursor.execute("INSERT INTO users (id, favorite_id) VALUES (?, ?)", (user_id, favorite_id))
+    conn.commit()
+    return favorite_id
 
-    cursor.execute('''
-        SELECT 1
-        FROM favorite_items
-        WHERE favorite_id = ? AND product_id = ?
-    ''', (favorite_id, product_id))
-    existing_item = cursor.fetchone()
+async def set_favorite(user_id, product_id, in_favorites):
+    """Добавляет товар в избранное или удаляет из него; возвращает сохраненное (после commit) состояние."""
+    return await asyncio.wrap_future(favorites_writer.submit(user_id, product_id, in_favorites))
 
-    if not existing_item:
-        cursor.execute("INSERT INTO favorite_items (favorite_id, product_id) VALUES (?, ?)", (favorite_id, product_id))
-        conn.commit()
-    conn.close()
+async def add_to_favorites(user_id, product_id):
+    return await set_favorite(user_id, product_id, True)
 
-def remove_from_favorites(user_id, product_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    favorite_id = get_or_create_user_favorites(user_id)
-    cursor.execute("DELETE FROM favorite_items WHERE favorite_id = ? AND product_id = ?", (favorite_id, product_id))
-    conn.commit()
-    conn.close()
+async def remove_from_favorites(user_id, product_id):
+    return await set_favorite(user_id, product_id, False)
 
-def show_favorites(user_id):
-    conn = get_db_connection()
+def _get_favorite_items(conn, user_id):
+    favorite_id = get_or_create_user_favorites(conn, user_id)
     cursor = conn.cursor()
-    favorite_id = get_or_create_user_favorites(user_id)
     cursor.execute('''
         SELECT products.id, products.name
         FROM favorite_items
         JOIN products ON favorite_items.product_id = products.id
         WHERE favorite_items.favorite_id = ?
     ''', (favorite_id,))
-    favorite_items = cursor.fetchall()
-    conn.close()
+    return cursor.fetchall()
+
+async def show_favorites(user_id):
+    favorite_items = await db.run(_get_favorite_items, user_id)
 
     if not favorite_items:
         return "Ваше избранное пусто."
@@ -149,56 +216,57 @@ def show_favorites(user_id):
         builder.adjust(1)
         return builder.as_markup()
 
-async def is_product_in_favorites(user_id, product_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    favorite_id = get_or_create_user_favorites(user_id)
-    cursor.execute('''
+# Признак «в избранном» одним запросом, без создания избранного (у нового пользователя его просто нет)
+IS_FAVORITE_SQL = '''
+    SELECT EXISTS (
         SELECT 1
-        FROM favorite_items
-        WHERE favorite_id = ? AND product_id = ?
-    ''', (favorite_id, product_id))
-    result = cursor.fetchone()
-    conn.close()
-    return result is not None
-
-async def show_product_details(product_id, chat_id, user_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT products.name, description, price, image_url, seller_contacts, categories.name AS category_name
-        FROM products
-        JOIN categories ON products.category_id = categories.id
-        WHERE products.id = ?
-    ''', (product_id,))
-    product = cursor.fetchone()
-    conn.close()
+        FROM users
+        JOIN favorite_items ON favorite_items.favorite_id = users.favorite_id
+        WHERE users.id = ? AND favorite_items.product_id = ?
+    )
+'''
 
-    if not product:
-        await bot.send_message(chat_id, "Товар не найден.")
-        return
+async def is_product_in_favorites(user_id, product_id):
+    row = await db.fetchone(IS_FAVORITE_SQL, (user_id, product_id))
+    return bool(row[0])
 
-    product_name = product['name']
-    product_description = product['description']
-    product_price = product['price']
-    product_image_url = product['image_url']
-    seller_contacts = product['seller_contacts']
-    category_name = product['category_name']
+async def get_product_view(user_id, product_id):
+    """Возвращает товар (с названием категории) и признак «в избранном» или (None, False), если товара нет.
 
-    is_in_favorites = await is_product_in_favorites(user_id, product_id)
+    Карточка товара берется из каталога в памяти, поэтому к базе уходит один запрос.
+    """
+    product = await get_product(product_id)
+    if product is None:
+        return None, False
+    return product, await is_product_in_favorites(user_id, product_id)
 
+def create_product_keyboard(product, is_in_favorites):
     builder = InlineKeyboardBuilder()
 
     if is_in_favorites:
         button_text = "Удалить из избранного"
-        callback_data = f"remove_from_favorites_{product_id}"
+        callback_data = f"remove_from_favorites_{product.id}"
     else:
         button_text = "Добавить в избранное"
-        callback_data = f"add_to_favorites_{product_id}"
+        callback_data = f"add_to_favorites_{product.id}"
 
     fav_button = InlineKeyboardButton(text=button_text, callback_data=callback_data)
-    back_to_products_button = InlineKeyboardButton(text="Назад к товарам", callback_data=f"back_to_products_{category_name}")
+    back_to_products_button = InlineKeyboardButton(text="Назад к товарам", callback_data=f"back_to_products_{product.category_name}")
     builder.add(fav_button, back_to_products_button)
+    return builder.as_markup()
+
+async def show_product_details(product_id, chat_id, user_id):
+    product, is_in_favorites = await get_product_view(user_id, product_id)
+
+    if not product:
+        await bot.send_message(chat_id, "Товар не найден.")
+        return
+
+    product_name = product.name
+    product_description = product.description
+    product_price = product.price
+    product_image_url = product.image_url
+    seller_contacts = product.seller_contacts
 
     product_info = (
         f"*{product_name}*\n"
@@ -207,116 +275,77 @@ async def show_product_details(product_id, chat_id, user_id):
         f"Продавец: {seller_contacts}\n"
         f"id: {product_id}"
     )
+    markup = create_product_keyboard(product, is_in_favorites)
 
     if product_image_url:
-        sent_message = await bot.send_photo(chat_id, product_image_url, caption=product_info, reply_markup=builder.as_markup())
+        sent_message = await bot.send_photo(chat_id, product_image_url, caption=product_info, reply_markup=markup)
     else:
-        sent_message = await bot.send_message(chat_id, product_info, reply_markup=builder.as_markup())
+        sent_message = await bot.send_message(chat_id, product_info, reply_markup=markup)
             # Сохраняем message_id
     msg_id = sent_message.message_id
     return msg_id
 
-async def update_product_details(chat_id, message_id, user_id, product_id, category_name):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT products.name, description, price, image_url, seller_contacts, categories.name AS category_name
-        FROM products
-        JOIN categories ON products.category_id = categories.id
-        WHERE products.id = ?
-    ''', (product_id,))
-    product = cursor.fetchone()
-    conn.close()
-
-    if not product:
-        await bot.send_message(chat_id, "Товар не найден.")
-        return
-
-    product_name = product['name']
-    product_description = product['description']
-    product_price = product['price']
-    product_image_url = product['image_url']
-    seller_contacts = product['seller_contacts']
-
-    is_in_favorites = await is_product_in_favorites(user_id, product_id)
-
-    builder = InlineKeyboardBuilder()
-
-    if is_in_favorites:
-        button_text = "Удалить из избранного"
-        callback_data = f"remove_from_favorites_{product_id}"
-    else:
-        button_text = "Добавить в избранное"
-        callback_data = f"add_to_favorites_{product_id}"
-
-    fav_button = InlineKeyboardButton(text=button_text, callback_data=callback_data)
-    back_to_products_button = InlineKeyboardButton(text="Назад к товарам", callback_data=f"back_to_products_{category_name}")
-    builder.add(fav_button, back_to_products_button)
-    await bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=builder.as_markup())
+async def update_product_details(chat_id, message_id, product, is_in_favorites):
+    """Меняет кнопку избранного в карточке товара (состояние возвращает запись избранного, запрос не нужен)."""
+    markup = create_product_keyboard(product, is_in_favorites)
+    await bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=markup)
 
 @dp.callback_query(F.data.startswith("show_product_"))
 async def callback_show_product(call: types.CallbackQuery):
     product_id = int(call.data.split("_")[2])
     user_id = call.from_user.id
-    await show_product_details(product_id, call.message.chat.id, user_id)
+    # У сообщения, отправленного через inline-поиск, нет чата с ботом: карточка приходит в личные сообщения
+    chat_id = call.message.chat.id if call.message else user_id
+    await show_product_details(product_id, chat_id, user_id)
     await call.answer()
 
 @dp.callback_query(F.data.startswith("add_to_favorites_"))
 async def callback_add_to_favorites(call: types.CallbackQuery):
     product_id = int(call.data.split("_")[3])
     user_id = call.from_user.id
-    add_to_favorites(user_id, product_id)
+    is_in_favorites = await add_to_favorites(user_id, product_id)
     await call.answer("Товар добавлен в избранное!")
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT products.name, description, price, image_url, seller_contacts, categories.name AS category_name
-        FROM products
-        JOIN categories ON products.category_id = categories.id
-        WHERE products.id = ?
-    ''', (product_id,))
-    product = cursor.fetchone()
-    conn.close()
-    category_name = product['category_name']
-    await update_product_details(call.message.chat.id, call.message.message_id,  user_id, product_id, category_name)
+    product = await get_product(product_id)
+    if product is not None:
+        await update_product_details(call.message.chat.id, call.message.message_id, product, is_in_favorites)
 
 @dp.callback_query(F.data.startswith("remove_from_favorites_"))
 async def callback_remove_from_favorites(call: types.CallbackQuery):
     product_id = int(call.data.split("_")[3])
     user_id = call.from_user.id
-    remove_from_favorites(user_id, product_id)
+    is_in_favorites = await remove_from_favorites(user_id, product_id)
     await call.answer("Товар удален из избранного!")
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT products.name, description, price, image_url, seller_contacts, categories.name AS category_name
-        FROM products
-        JOIN categories ON products.category_id = categories.id
-        WHERE products.id = ?
-    ''', (product_id,))
-    product = cursor.fetchone()
-    conn.close()
-    category_name = product['category_name']
-    await update_product_details(call.message.chat.id, call.message.message_id,  user_id, product_id, category_name)
+    product = await get_product(product_id)
+    if product is not None:
+        await update_product_details(call.message.chat.id, call.message.message_id, product, is_in_favorites)
+
+@dp.callback_query(F.data.startswith("products_page_"))
+async def callback_products_page(call: types.CallbackQuery):
+    """Показывает другую страницу списка товаров в том же сообщении."""
+    category_id, after_id = map(int, call.data.split("_")[2:4])
+    category = (await get_catalog()).category_names.get(category_id)
+    if category is None:
+        await call.answer("Категория не найдена.")
+        return
+    products_keyboard = await create_products_keyboard(category, after_id)
+    await bot.edit_message_reply_markup(chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=products_keyboard)
+    await call.answer()
 
 @dp.callback_query(F.data.startswith("back_to_products_"))
 async def callback_back_to_products(call: types.CallbackQuery):
     """Возвращает к списку товаров."""
     category = call.data.split("_")[3]
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    products_keyboard = create_products_keyboard(category)
+    products_keyboard = await create_products_keyboard(category)
     await bot.send_message(call.message.chat.id, text=f"Товары в категории '{category}':", reply_markup=products_keyboard)
     # bot.delete_message(call.message.chat.id, call.message.message_id)
     await call.answer()
-    conn.close()
 
 @dp.callback_query(F.data == "back_to_categories")
 async def callback_back_to_categories(call: types.CallbackQuery):
     """Возвращает к списку категорий."""
-    await bot.send_message(call.message.chat.id, text="Выберите категорию:", reply_markup=create_categories_keyboard())
+    await bot.send_message(call.message.chat.id, text="Выберите категорию:", reply_markup=await create_categories_keyboard())
     # bot.delete_message(call.message.chat.id, call.message.message_id)
     await call.answer()
 
@@ -328,31 +357,85 @@ async def send_welcome(message: types.Message):
         "У нас вы найдете всякую всячину со всего света,\n"
         "Выберите категорию, чтобы посмотреть товары:"
     )
-    await message.reply(welcome_message, reply_markup=create_categories_keyboard())
+    await message.reply(welcome_message, reply_markup=await create_categories_keyboard())
+
+async def search_products(text):
+    """Товары по запросу (полнотекстовый поиск) от самых подходящих."""
+    product_ids = await db.run(search_product_ids, text, SEARCH_RESULTS)
+    products = (await get_catalog()).products
+    return [products[product_id] for product_id in product_ids if product_id in products]
+
+def create_search_keyboard(products):
+    builder = InlineKeyboardBuilder()
+    for product in products:
+        builder.row(InlineKeyboardButton(text=f"{product.name} (ID: {product.id})", callback_data=f"show_product_{product.id}"))
+    return builder.as_markup()
+
+@dp.message(Command("search"))
+async def search_command(message: types.Message, command: CommandObject):
+    query = (command.args or "").strip()
+    if not query:
+        await message.reply("Напишите, что найти: /search <название или слова из описания>")
+        return
+
+    products = await search_products(query)
+    if not products:
+        await message.reply(f"По запросу '{query}' ничего не найдено.")
+        return
+    await message.reply(f"Найдено по запросу '{query}':", reply_markup=create_search_keyboard(products))
+
+@dp.inline_query()
+async def inline_search(inline_query: types.InlineQuery):
+    """Поиск товаров в inline-режиме: @бот <запрос> в любом чате."""
+    # Запросы приходят на каждое нажатие клавиши: ищем только по последнему после паузы
+    user_id = inline_query.from_user.id
+    inline_latest[user_id] = inline_query.id
+    await asyncio.sleep(INLINE_DEBOUNCE)
+    if inline_latest.get(user_id) != inline_query.id:
+        return
+    del inline_latest[user_id]
+
+    products = await search_products(inline_query.query) if inline_query.query.strip() else []
+    results = [
+        InlineQueryResultArticle(
+            id=str(product.id),
+            title=product.name,
+            description=f"{product.price:.2f} руб, {product.category_name}",
+            input_message_content=InputTextMessageContent(
+                message_text=f"{product.name}\n{product.price:.2f} руб\nПродавец: {product.seller_contacts}"
+            ),
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="Подробнее", callback_data=f"show_product_{product.id}")]
+            ]),
+        )
+        for product in products
+    ]
+    await inline_query.answer(results, cache_time=SEARCH_CACHE_TIME)
 
 @dp.message(F.text)
 async def handle_messages(message: types.Message):
     user_id = message.from_user.id
     text = message.text
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT name FROM categories")
-    categories = [row[0] for row in cursor.fetchall()]
-    conn.close()
+    categories = (await get_catalog()).category_ids
 
     if text in categories and text != "Избранное":
-        markup = create_products_keyboard(text)
+        markup = await create_products_keyboard(text)
         await message.answer(f"Товары в категории '{text}':", reply_markup=markup)
     elif text == "Избранное":
-        markup = show_favorites(user_id)
+        markup = await show_favorites(user_id)
         if isinstance(markup, str):
             await message.reply(markup)
         else:
             await message.reply("Ваше избранное:", reply_markup=markup)
 
 async def main():
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        favorites_writer.close()
+        db.close()
+        await bot.session.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
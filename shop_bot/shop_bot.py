@@ -2,8 +2,15 @@ import telebot
 import os
 from dotenv import load_dotenv
 import sqlite3
+import threading
 from telebot import types
 
+from shop_db import DB_PATH
+from shop_catalog import Catalog, CHECK_INTERVAL, PAGE_SIZE
+from shop_migrations import migrate
+from shop_favorites import FavoritesWriter, BATCH_WINDOW
+from shop_search import search_product_ids, SEARCH_LIMIT
+
 # Загружаем переменные окружения из .env файла
 load_dotenv()
 
@@ -14,14 +21,53 @@ if not BOT_TOKEN:
     print("Ошибка: Необходима переменная окружения TELEGRAM_BOT_TOKEN.")
     exit()
 
+SHOP_DB = os.environ.get("SHOP_DB", DB_PATH)  # Путь к базе данных
+CATALOG_CHECK_INTERVAL = float(os.environ.get("CATALOG_CHECK_INTERVAL", CHECK_INTERVAL))  # Как часто сверять версию каталога, с
+PRODUCTS_PAGE_SIZE = int(os.environ.get("PRODUCTS_PAGE_SIZE", PAGE_SIZE))  # Товаров на странице списка категории
+SEARCH_RESULTS = int(os.environ.get("SEARCH_RESULTS", SEARCH_LIMIT))  # Сколько товаров показывать в результатах поиска
+SEARCH_CACHE_TIME = int(os.environ.get("SEARCH_CACHE_TIME", 30))  # Сколько секунд Telegram кэширует ответ на inline-запрос
+INLINE_DEBOUNCE = float(os.environ.get("INLINE_DEBOUNCE", 0.4))  # Пауза после ввода, прежде чем искать, с
+FAVORITES_BATCH_WINDOW = float(os.environ.get("FAVORITES_BATCH_WINDOW", BATCH_WINDOW))  # Сколько собирать изменения избранного в одну транзакцию, с
+
 bot = telebot.TeleBot(BOT_TOKEN)
 
+# Каталог (категории и товары) в памяти: перечитывается, только когда его версия в базе изменилась
+catalog = Catalog(CATALOG_CHECK_INTERVAL)
+
+# Изменения избранного записываются пачками в отдельном потоке. Поток и его соединение создаются
+# при первом изменении избранного, а не при импорте модуля (и уже после миграций при запуске бота).
+favorites_writer = None
+favorites_writer_lock = threading.Lock()
+
+def get_favorites_writer():
+    global favorites_writer
+    with favorites_writer_lock:
+        if favorites_writer is None:
+            favorites_writer = FavoritesWriter(SHOP_DB, FAVORITES_BATCH_WINDOW)
+        return favorites_writer
+
+# Ответы на inline-запросы откладываются на INLINE_DEBOUNCE: id пользователя -> таймер его последнего запроса.
+# Таймер, а не sleep в обработчике, чтобы ожидание не занимало потоки, которые обрабатывают остальные сообщения.
+inline_timers = {}
+inline_timers_lock = threading.Lock()
+
 # Функция для создания соединения с БД
 def get_db_connection():
-    conn = sqlite3.connect('db/shop.db') # Путь к базе данных
+    conn = sqlite3.connect(SHOP_DB) # Путь к базе данных
     conn.row_factory = sqlite3.Row  # Для доступа к данным по именам столбцов
     return conn
 
+def get_catalog():
+    """Возвращает снимок каталога (без запроса к БД, если версия недавно сверялась)."""
+    snapshot = catalog.fresh()
+    if snapshot is None:
+        conn = get_db_connection()
+        try:
+            snapshot = catalog.get(conn)
+        finally:
+            conn.close()
+    return snapshot
+
 # --- Функции для работы с базой данных ---
 def add_category(category_name):
     """Добавляет категорию в базу данных."""
@@ -31,6 +77,7 @@ def add_category(category_name):
         cursor.execute("INSERT INTO categories (name) VALUES (?)", (category_name,))
         conn.commit()
         conn.close()
+        catalog.invalidate()
         return True
     except sqlite3.IntegrityError:
         return False  # Категория уже существует
@@ -42,6 +89,7 @@ def delete_category(category_name):
     cursor.execute("DELETE FROM categories WHERE name = ?", (category_name,))
     conn.commit()
     conn.close()
+    catalog.invalidate()
 
 def add_product(category_id, name, description, price, image_url, seller_contacts):
     """Добавляет продукт в базу данных."""
@@ -53,6 +101,7 @@ def add_product(category_id, name, description, price, image_url, seller_contact
     ''', (category_id, name, description, price, image_url, seller_contacts))
     conn.commit()
     conn.close()
+    catalog.invalidate()
 
 def delete_product(product_id):
     """Удаляет продукт из базы данных."""
@@ -61,6 +110,7 @@ def delete_product(product_id):
     cursor.execute("DELETE FROM products WHERE id = ?", (product_id,))
     conn.commit()
     conn.close()
+    catalog.invalidate()
 
 def is_admin(user_id):
     """Проверяет, является ли пользователь администратором."""
@@ -72,13 +122,20 @@ def is_admin(user_id):
     return result is not None
 
 # --- Функции для создания клавиатур ---
-def create_categories_keyboard():
+class FrozenMarkup(types.JsonSerializable):
+    """Готовая клавиатура: JSON собирается один раз, объект общий для всех пользователей и не изменяется."""
+    __slots__ = ("_json",)
+
+    def __init__(self, markup):
+        self._json = markup.to_json()
+
+    def to_json(self):
+        return self._json
+
+# Клавиатуры каталога собираются один раз для каждой версии каталога (snapshot.markup)
+def build_categories_keyboard(snapshot):
     """Создает клавиатуру с категориями товаров."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT name FROM categories")
-    categories = [row[0] for row in cursor.fetchall()]
-    conn.close()
+    categories = list(snapshot.categories)
 
     # Добавляем "Избранное" в начало списка категорий (если его там нет)
     if "Избранное" in categories:
@@ -88,29 +145,42 @@ def create_categories_keyboard():
     markup = telebot.types.ReplyKeyboardMarkup(resize_keyboard=True)
     for category in categories:
         markup.add(telebot.types.KeyboardButton(category))
-    return markup
+    return FrozenMarkup(markup)
 
-def create_products_keyboard(category):
-    """Создает клавиатуру с товарами в выбранной категории."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT products.id, products.name FROM products
-        JOIN categories ON products.category_id = categories.id
-        WHERE categories.name = ?
-    ''', (category,))
-    products = cursor.fetchall()
-    conn.close()
+def create_categories_keyboard():
+    return get_catalog().markup("categories", build_categories_keyboard)
+
+def build_products_keyboard(snapshot, category, page):
+    """Создает клавиатуру с товарами одной страницы выбранной категории."""
+    category_id = snapshot.category_ids.get(category)
     markup = telebot.types.InlineKeyboardMarkup()
-    for product in products:
-        product_id = product['id']
-        product_name = product['name']
+    for product in page.products:
+        product_id = product.id
+        product_name = product.name
         button_text = f"{product_name} (ID: {product_id})"  # Добавляем ID продукта в текст кнопки
         callback_data = f"show_product_{product_id}"  # Используем ID товара
         button = telebot.types.InlineKeyboardButton(button_text, callback_data=callback_data)
         markup.add(button)
+    # Переход по страницам: в callback_data - id категории и id последнего товара перед страницей
+    navigation = []
+    if page.prev_after is not None:
+        navigation.append(telebot.types.InlineKeyboardButton(f"« {page.number - 1}", callback_data=f"products_page_{category_id}_{page.prev_after}"))
+    if page.next_after is not None:
+        navigation.append(telebot.types.InlineKeyboardButton(f"{page.number + 1} »", callback_data=f"products_page_{category_id}_{page.next_after}"))
+    if navigation:
+        markup.row(*navigation)
     markup.add(telebot.types.InlineKeyboardButton("Назад к категориям", callback_data="back_to_categories"))
-    return markup
+    return FrozenMarkup(markup)
+
+def create_products_keyboard(category, after_id=0):
+    snapshot = get_catalog()
+    if category not in snapshot.products_by_category:
+        category = None  # Для неизвестных категорий клавиатура одна (только «Назад»), кэш не растет
+    page = snapshot.product_page(category, after_id, PRODUCTS_PAGE_SIZE)
+    if page.start % PRODUCTS_PAGE_SIZE:
+        # Страница со сдвигом (каталог изменился после показа списка) собирается без кэша
+        return build_products_keyboard(snapshot, category, page)
+    return snapshot.markup(("products", category, page.start), build_products_keyboard, category, page)
 
 def create_admin_keyboard():
     """Создает клавиатуру для администратора."""
@@ -150,33 +220,12 @@ def get_or_create_user_favorites(user_id):
         return favorite_id
 
 def add_to_favorites(user_id, product_id):
-    """Добавляет товар в избранное пользователя, если его там еще нет."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    favorite_id = get_or_create_user_favorites(user_id)
-
-    # Проверяем, есть ли уже товар в избранном
-    cursor.execute('''
-        SELECT 1
-        FROM favorite_items
-        WHERE favorite_id = ? AND product_id = ?
-    ''', (favorite_id, product_id))
-    existing_item = cursor.fetchone()
-
-    if not existing_item:
-        # Если товара нет, добавляем его в избранное
-        cursor.execute("INSERT INTO favorite_items (favorite_id, product_id) VALUES (?, ?)", (favorite_id, product_id))
-        conn.commit()
-    conn.close()
+    """Добавляет товар в избранное пользователя; возвращает сохраненное (после commit) состояние."""
+    return get_favorites_writer().submit(user_id, product_id, True).result()
 
 def remove_from_favorites(user_id, product_id):
-    """Удаляет товар из избранного пользователя."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    favorite_id = get_or_create_user_favorites(user_id)
-    cursor.execute("DELETE FROM favorite_items WHERE favorite_id = ? AND product_id = ?", (favorite_id, product_id))
-    conn.commit()
-    conn.close()
+    """Удаляет товар из избранного пользователя; возвращает сохраненное (после commit) состояние."""
+    return get_favorites_writer().submit(user_id, product_id, False).result()
 
 def show_favorites(user_id):
     """Формирует сообщение с содержимым избранного."""
@@ -214,14 +263,12 @@ def send_welcome(message):
     )
     bot.reply_to(message, welcome_message, reply_markup=create_categories_keyboard())
 
-@bot.message_handler(func=lambda message: message.text in [row[0] for row in get_db_connection().cursor().execute("SELECT name FROM categories").fetchall()])
 def show_products(message):
     """Показывает товары в выбранной категории."""
     category = message.text
     markup = create_products_keyboard(category)
     bot.send_message(message.chat.id, f"Товары в категории '{category}':", reply_markup=markup)
 
-@bot.message_handler(func=lambda message: message.text == "Избранное")
 def view_favorites(message):
     """Показывает содержимое избранного."""
     user_id = message.from_user.id
@@ -232,28 +279,29 @@ def view_favorites(message):
         bot.reply_to(message, "Ваше избранное:", reply_markup=markup)  # Отправляем клавиатуру с товарами
 
 # --- Обработчики callback-запросов ---
-@bot.callback_query_handler(func=lambda call: call.data.startswith("add_to_favorites_"))
-def callback_add_to_favorites(call):
-    """Обрабатывает нажатия на кнопки добавления в избранное."""
-    user_id = call.from_user.id
-    product_id = int(call.data.split("_")[3])  # Получаем ID товара
-    add_to_favorites(user_id, product_id)
-    bot.answer_callback_query(call.id, "Товар добавлен в избранное!")
-
-@bot.callback_query_handler(func=lambda call: call.data.startswith("remove_from_favorites_"))
-def callback_remove_from_favorites(call):
-    """Обрабатывает нажатия на кнопки удаления из избранного."""
-    user_id = call.from_user.id
-    product_id = int(call.data.split("_")[3])  # Получаем ID товара
-    remove_from_favorites(user_id, product_id)
-    bot.answer_callback_query(call.id, "Товар удален из избранного!")
-
 @bot.callback_query_handler(func=lambda call: call.data.startswith("show_product_"))
 def callback_show_product(call):
     """Выводит подробную информацию о товаре."""
     product_id = int(call.data.split("_")[2]) #извлекаем product_id
     user_id = call.from_user.id  # Получаем id пользователя
-    show_product_details(product_id, call.message.chat.id, user_id)
+    # У сообщения, отправленного через inline-поиск, нет чата с ботом: карточка приходит в личные сообщения
+    chat_id = call.message.chat.id if call.message else user_id
+    show_product_details(product_id, chat_id, user_id)
+    bot.answer_callback_query(call.id)  # Убираем "часики" на кнопке
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("products_page_"))
+def callback_products_page(call):
+    """Показывает другую страницу списка товаров в том же сообщении."""
+    category_id, after_id = map(int, call.data.split("_")[2:4])
+    category = get_catalog().category_names.get(category_id)
+    if category is None:
+        bot.answer_callback_query(call.id, "Категория не найдена.")
+        return
+    products_keyboard = create_products_keyboard(category, after_id)
+    try:
+        bot.edit_message_reply_markup(chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=products_keyboard)
+    except Exception as e:
+        print(f"Ошибка при редактировании сообщения: {e}")
     bot.answer_callback_query(call.id)  # Убираем "часики" на кнопке
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("back_to_products_"))
@@ -284,11 +332,10 @@ def process_delete_category(message):
 def process_add_product_category(message):
     """Обрабатывает выбор категории для нового продукта."""
     category_name = message.text
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM categories WHERE name = ?", (category_name,))
-    category_id = cursor.fetchone()[0]
-    conn.close()
+    category_id = get_catalog().category_ids.get(category_name)
+    if category_id is None:
+        bot.send_message(message.chat.id, "Категория не найдена.", reply_markup=create_admin_keyboard())
+        return
 
     # Сохраняем category_id и переходим к запросу названия продукта
     bot.send_message(message.chat.id, "Введите название нового продукта:")
@@ -340,27 +387,18 @@ def process_delete_product(message):
 # --- Функции для работы с базой данных (не изменяются) ---
 def show_product_details(product_id, chat_id, user_id):
     """Выводит подробную информацию о товаре."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT products.name, description, price, image_url, seller_contacts, categories.name AS category_name
-        FROM products
-        JOIN categories ON products.category_id = categories.id
-        WHERE products.id = ?
-    ''', (product_id,))
-    product = cursor.fetchone()
-    conn.close()
+    product = get_catalog().products.get(product_id)
 
     if not product:
         bot.send_message(chat_id, "Товар не найден.")
         return
 
-    product_name = product['name']
-    product_description = product['description']
-    product_price = product['price']
-    product_image_url = product['image_url']
-    seller_contacts = product['seller_contacts']
-    category_name = product['category_name']  # Теперь у нас есть category_name
+    product_name = product.name
+    product_description = product.description
+    product_price = product.price
+    product_image_url = product.image_url
+    seller_contacts = product.seller_contacts
+    category_name = product.category_name  # Теперь у нас есть category_name
 
     is_in_favorites = is_product_in_favorites(user_id, product_id)
 
@@ -400,33 +438,27 @@ def show_product_details(product_id, chat_id, user_id):
         msg_id = sent_message.message_id
 
 def is_product_in_favorites(user_id, product_id):
-    """Проверяет, находится ли товар в избранном пользователя."""
+    """Проверяет, находится ли товар в избранном пользователя (одним запросом, без создания избранного)."""
     conn = get_db_connection()
     cursor = conn.cursor()
-    favorite_id = get_or_create_user_favorites(user_id)
     cursor.execute('''
-        SELECT 1
-        FROM favorite_items
-        WHERE favorite_id = ? AND product_id = ?
-    ''', (favorite_id, product_id))
+        SELECT EXISTS (
+            SELECT 1
+            FROM users
+            JOIN favorite_items ON favorite_items.favorite_id = users.favorite_id
+            WHERE users.id = ? AND favorite_items.product_id = ?
+        )
+    ''', (user_id, product_id))
     result = cursor.fetchone()
     conn.close()
-    return result is not None
+    return bool(result[0])
 
 def get_category_name_by_product_id(product_id):
     """Получает название категории по ID продукта."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''SELECT category_id FROM products WHERE id = ?''', (product_id,))
-    category_id = cursor.fetchone()
-    if category_id is None:
-        conn.close()
+    product = get_catalog().products.get(product_id)
+    if product is None:
         return None  # Или какое-то значение по умолчанию, если категория не найдена
-    category_id = category_id[0]
-    cursor.execute('''SELECT name FROM categories WHERE id = ?''', (category_id,))
-    category = cursor.fetchone()[0]
-    conn.close()
-    return category
+    return product.category_name
 
 @bot.message_handler(commands=['start', 'help'])
 def send_welcome(message):
@@ -451,39 +483,21 @@ def send_welcome(message):
     bot.reply_to(message, welcome_message, reply_markup=create_categories_keyboard())
 
 # --- Обработчики callback-запросов ---
-@bot.callback_query_handler(func=lambda call: call.data.startswith("add_to_favorites_"))
-def callback_add_to_favorites(call):
-    """Обрабатывает нажатия на кнопки добавления в избранное."""
-    user_id = call.from_user.id
-    product_id = int(call.data.split("_")[2])  # Получаем ID товара
-    add_to_favorites(user_id, product_id)
-    bot.answer_callback_query(call.id, "Товар добавлен в избранное!")
-
-@bot.callback_query_handler(func=lambda call: call.data.startswith("remove_from_favorites_"))
-def callback_remove_from_favorites(call):
-    """Обрабатывает нажатия на кнопки удаления из избранного."""
-    user_id = call.from_user.id
-    product_id = int(call.data.split("_")[2])  # Получаем ID товара
-    remove_from_favorites(user_id, product_id)
-    bot.answer_callback_query(call.id, "Товар удален из избранного!")
-
- # --- Обработчики callback-запросов ---
 @bot.callback_query_handler(func=lambda call: call.data.startswith("add_to_favorites_") or call.data.startswith("remove_from_favorites_"))
 def callback_toggle_favorites(call):
     """Обрабатывает нажатия на кнопки добавления/удаления из избранного."""
     user_id = call.from_user.id
-    product_id = int(call.data.split("_")[2])  # Получаем ID товара
+    product_id = int(call.data.rsplit("_", 1)[1])  # Получаем ID товара
     chat_id = call.message.chat.id
     message_id = call.message.message_id
 
+    # Кнопка показывает состояние, сохраненное в базе
     if call.data.startswith("add_to_favorites_"):
-        add_to_favorites(user_id, product_id)
-        is_in_favorites = True  # Теперь в избранном
+        is_in_favorites = add_to_favorites(user_id, product_id)
     else:
-        remove_from_favorites(user_id, product_id)
-        is_in_favorites = False  # Теперь не в избранном
+        is_in_favorites = remove_from_favorites(user_id, product_id)
 
-    bot.answer_callback_query(call.id)
+    bot.answer_callback_query(call.id, "Товар добавлен в избранное!" if is_in_favorites else "Товар удален из избранного!")
 
     # Определяем текст и callback_data для новой кнопки
     if is_in_favorites:
@@ -497,8 +511,8 @@ def callback_toggle_favorites(call):
     new_markup = types.InlineKeyboardMarkup()
     fav_button = types.InlineKeyboardButton(button_text, callback_data=callback_data)
 
-    #category_name = get_category_name_by_product_id(product_id) #Получаем имя категории
-    back_to_products_button = types.InlineKeyboardButton("Назад к товарам", callback_data=f"back_to_products_{get_category_name_by_product_id(product_id)}") # Кнопка "Назад"
+    category_name = get_category_name_by_product_id(product_id)  # Категория берется из снимка каталога
+    back_to_products_button = types.InlineKeyboardButton("Назад к товарам", callback_data=f"back_to_products_{category_name}") # Кнопка "Назад"
     new_markup.add(fav_button)
     new_markup.add(back_to_products_button)
 
@@ -513,7 +527,9 @@ def callback_show_product(call):
     """Выводит подробную информацию о товаре."""
     product_id = int(call.data.split("_")[2]) #извлекаем product_id
     user_id = call.from_user.id  # Получаем id пользователя
-    show_product_details(product_id, call.message.chat.id, user_id)
+    # У сообщения, отправленного через inline-поиск, нет чата с ботом: карточка приходит в личные сообщения
+    chat_id = call.message.chat.id if call.message else user_id
+    show_product_details(product_id, chat_id, user_id)
     bot.answer_callback_query(call.id)  # Убираем "часики" на кнопке
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("back_to_products_"))
@@ -544,22 +560,16 @@ def admin_panel(message):
     else:
         bot.send_message(message.chat.id, "У вас нет прав для выполнения этой команды.")
 
-@bot.message_handler(func=lambda message: message.text == "Добавить категорию")
 def ask_category_name(message):
     """Запрашивает название новой категории."""
     if is_admin(message.from_user.id):
         bot.send_message(message.chat.id, "Введите название новой категории:")
         bot.register_next_step_handler(message, process_add_category) #После этого сообщения ждет ввода текста и вызывает функцию process_add_category
 
-@bot.message_handler(func=lambda message: message.text == "Удалить категорию")
 def ask_delete_category(message):
      """Запрашивает название категории для удаления."""
      if is_admin(message.from_user.id):
-         conn = get_db_connection()
-         cursor = conn.cursor()
-         cursor.execute("SELECT name FROM categories")
-         categories = [row[0] for row in cursor.fetchall()]
-         conn.close()
+         categories = get_catalog().categories
 
          if not categories:
              bot.send_message(message.chat.id, "Нет категорий для удаления.")
@@ -571,15 +581,10 @@ def ask_delete_category(message):
          bot.send_message(message.chat.id, "Выберите категорию для удаления:", reply_markup=keyboard)
          bot.register_next_step_handler(message, process_delete_category)
 
-@bot.message_handler(func=lambda message: message.text == "Добавить продукт")
 def ask_add_product(message):
     """Запрашивает данные для добавления нового продукта."""
     if is_admin(message.from_user.id):
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM categories")
-        categories = [row[0] for row in cursor.fetchall()]
-        conn.close()
+        categories = get_catalog().categories
 
         if not categories:
             bot.send_message(message.chat.id, "Сначала добавьте хотя бы одну категорию.")
@@ -592,13 +597,119 @@ def ask_add_product(message):
         bot.register_next_step_handler(message, process_add_product_category) #После выбора категории переходим к следующему шагу
 
 
-@bot.message_handler(func=lambda message: message.text == "Удалить продукт")
 def ask_delete_product(message):
     """Запрашивает ID продукта для удаления."""
     if is_admin(message.from_user.id):
         bot.send_message(message.chat.id, "Введите ID продукта для удаления:")
         bot.register_next_step_handler(message, process_delete_product)
 
+# --- Поиск товаров ---
+def search_products(text):
+    """Ищет товары по названию и описанию (полнотекстовый поиск), от самых подходящих."""
+    conn = get_db_connection()
+    try:
+        product_ids = search_product_ids(conn, text, SEARCH_RESULTS)
+    finally:
+        conn.close()
+    products = get_catalog().products
+    return [products[product_id] for product_id in product_ids if product_id in products]
+
+def create_search_keyboard(products):
+    """Создает клавиатуру с найденными товарами."""
+    markup = types.InlineKeyboardMarkup()
+    for product in products:
+        markup.add(types.InlineKeyboardButton(f"{product.name} (ID: {product.id})", callback_data=f"show_product_{product.id}"))
+    return markup
+
+@bot.message_handler(commands=['search'])
+def search_command(message):
+    """Ищет товары: /search <запрос>."""
+    query = (telebot.util.extract_arguments(message.text) or "").strip()
+    if not query:
+        bot.reply_to(message, "Напишите, что найти: /search <название или слова из описания>")
+        return
+
+    products = search_products(query)
+    if not products:
+        bot.reply_to(message, f"По запросу '{query}' ничего не найдено.")
+        return
+    bot.reply_to(message, f"Найдено по запросу '{query}':", reply_markup=create_search_keyboard(products))
+
+@bot.inline_handler(func=lambda query: True)
+def inline_search(inline_query):
+    """Поиск товаров в inline-режиме: @бот <запрос> в любом чате."""
+    # Запросы приходят на каждое нажатие клавиши: ищем только по последнему после паузы
+    user_id = inline_query.from_user.id
+    timer = threading.Timer(INLINE_DEBOUNCE, answer_inline_search, (inline_query,))
+    timer.daemon = True
+    with inline_timers_lock:
+        previous = inline_timers.get(user_id)
+        if previous is not None:
+            previous.cancel()
+        inline_timers[user_id] = timer
+    timer.start()
+
+def answer_inline_search(inline_query):
+    """Отвечает на inline-запрос найденными товарами (в потоке таймера)."""
+    user_id = inline_query.from_user.id
+    with inline_timers_lock:
+        if inline_timers.get(user_id) is not threading.current_thread():
+            return  # Пришел более новый запрос
+        del inline_timers[user_id]
+    try:
+        send_inline_results(inline_query)
+    except Exception as e:
+        print(f"Ошибка при ответе на inline-запрос: {e}")
+
+def send_inline_results(inline_query):
+    products = search_products(inline_query.query) if inline_query.query.strip() else []
+    results = []
+    for product in products:
+        markup = types.InlineKeyboardMarkup()
+        markup.add(types.InlineKeyboardButton("Подробнее", callback_data=f"show_product_{product.id}"))
+        results.append(types.InlineQueryResultArticle(
+            id=str(product.id),
+            title=product.name,
+            description=f"{product.price:.2f} руб, {product.category_name}",
+            input_message_content=types.InputTextMessageContent(
+                f"{product.name}\n{product.price:.2f} руб\nПродавец: {product.seller_contacts}"
+            ),
+            reply_markup=markup,
+        ))
+    bot.answer_inline_query(inline_query.id, results, cache_time=SEARCH_CACHE_TIME)
+
+# --- Маршрутизация текстовых сообщений ---
+# Кнопки с постоянным текстом: текст -> обработчик. Они важнее категорий с таким же названием.
+BUTTON_ROUTES = {
+    "Избранное": view_favorites,
+    "Добавить категорию": ask_category_name,
+    "Удалить категорию": ask_delete_category,
+    "Добавить продукт": ask_add_product,
+    "Удалить продукт": ask_delete_product,
+}
+
+@bot.message_handler(content_types=['text'])
+def route_text(message):
+    """Передает текст кнопки нужному обработчику.
+
+    Вместо цепочки фильтров, которые telebot проверяет по очереди для каждого сообщения, текст ищется
+    в BUTTON_ROUTES и в названиях категорий из снимка каталога (он обновляется при изменении каталога),
+    без запроса к БД. Регистрируется последним, чтобы команды (/start, /admin) обрабатывались раньше.
+    """
+    handler = BUTTON_ROUTES.get(message.text)
+    if handler is not None:
+        handler(message)
+    elif message.text in get_catalog().category_ids:
+        show_products(message)
+
 # --- Основной цикл ---
 if __name__ == '__main__':
-    bot.infinity_polling()
\ No newline at end of file
+    # Миграции схемы: индексы и таблица версии каталога, по которой все процессы замечают изменения
+    conn = get_db_connection()
+    migrate(conn)
+    conn.close()
+    try:
+        bot.infinity_polling()
+    finally:
+        if favorites_writer is not None:
+            favorites_writer.close()
\ No newline at end of file
@@ -0,0 +1,162 @@
+"""Каталог магазина в памяти: категории, товары по категориям и карточки товаров.
+
+Каталог читается из базы целиком и отдается из памяти, пока не изменится его версия.
+Версия хранится в таблице catalog_version и увеличивается триггерами (см. shop_migrations.py)
+при любом изменении categories и products, поэтому изменения, сделанные другим процессом
+(например, админом в shop_bot.py), замечают все боты и потоки: для проверки достаточно прочитать одну строку.
+"""
+import threading
+import time
+from bisect import bisect_right
+
+CHECK_INTERVAL = 1.0  # Как часто (с) сверять версию каталога с базой
+PAGE_SIZE = 10  # Товаров на странице списка категории
+
+def catalog_version(conn) -> int:
+    return conn.execute("SELECT version FROM catalog_version WHERE id = 1").fetchone()[0]
+
+
+class Product:
+    """Карточка товара."""
+    __slots__ = ("id", "name", "description", "price", "image_url", "seller_contacts", "category_name")
+
+    def __init__(self, id, name, description, price, image_url, seller_contacts, category_name):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.price = price
+        self.image_url = image_url
+        self.seller_contacts = seller_contacts
+        self.category_name = category_name
+
+
+class ProductPage:
+    """Страница списка товаров категории."""
+    __slots__ = ("products", "start", "number", "pages", "prev_after", "next_after")
+
+    def __init__(self, products, start, number, pages, prev_after, next_after):
+        self.products = products  # Товары страницы (кортеж)
+        self.start = start  # Номер первого товара страницы в категории (с 0)
+        self.number = number  # Номер страницы (с 1) и число страниц
+        self.pages = pages
+        self.prev_after = prev_after  # after_id для предыдущей и следующей страницы или None, если ее нет
+        self.next_after = next_after
+
+
+class CatalogSnapshot:
+    """Неизменяемый снимок каталога одной версии."""
+    __slots__ = ("version", "categories", "category_ids", "category_names", "products_by_category", "product_ids",
+                 "products", "markups")
+
+    def __init__(self, version, categories, category_ids, products_by_category, products):
+        self.version = version
+        self.categories = categories  # Названия категорий в порядке базы (кортеж)
+        self.category_ids = category_ids  # название -> id
+        self.category_names = {category_id: name for name, category_id in category_ids.items()}  # id -> название
+        self.products_by_category = products_by_category  # название категории -> (Product, ...) по возрастанию id
+        self.product_ids = {name: tuple(product.id for product in items) for name, items in products_by_category.items()}
+        self.products = products  # id -> Product
+        self.markups = {}  # ключ клавиатуры (например, ("products", категория)) -> готовая клавиатура
+
+    def markup(self, key, build, *args):
+        """Возвращает клавиатуру build(self, *args), собранную один раз для этой версии каталога.
+
+        Кэш живет вместе со снимком: после изменения каталога новый снимок начинает с пустого кэша,
+        поэтому клавиатуры прежней версии не выдаются и не копятся. Возвращаемый объект общий
+        для всех пользователей, изменять его нельзя.
+        """
+        markup = self.markups.get(key)
+        if markup is None:
+            # Одновременная сборка в двух потоках безопасна: обе клавиатуры одинаковы, остается одна
+            markup = self.markups.setdefault(key, build(self, *args))
+        return markup
+
+    def product_page(self, category, after_id: int = 0, size: int = PAGE_SIZE) -> ProductPage:
+        """Страница товаров категории с id > after_id, как WHERE id > ? ORDER BY id LIMIT size.
+
+        Позиция находится двоичным поиском по id, поэтому страница любой категории строится
+        за одно и то же время, сколько бы в ней ни было товаров.
+        """
+        products = self.products_by_category.get(category, ())
+        ids = self.product_ids.get(category, ())
+        start = bisect_right(ids, after_id)
+        if start >= len(ids) and ids:
+            start = (len(ids) - 1) // size * size  # Страницы за концом нет (товары удалили) - последняя страница
+        end = start + size
+        prev_start = max(start - size, 0)
+        return ProductPage(
+            products[start:end],
+            start,
+            -(-start // size) + 1,
+            max(-(-len(ids) // size), 1),
+            (ids[prev_start - 1] if prev_start else 0) if start else None,
+            ids[end - 1] if end < len(ids) else None,
+        )
+
+
+def load_snapshot(conn) -> CatalogSnapshot:
+    """Читает каталог из базы.
+
+    Версия читается до данных: если каталог изменится во время чтения, снимок получит старую
+    версию и будет перечитан при следующей проверке.
+    """
+    version = catalog_version(conn)
+    categories = conn.execute("SELECT id, name FROM categories").fetchall()
+    category_names = {row[0]: row[1] for row in categories}
+    products = {}
+    products_by_category = {name: [] for name in category_names.values()}
+    for row in conn.execute('''
+        SELECT id, name, description, price, image_url, seller_contacts, category_id FROM products ORDER BY id
+    '''):
+        category_name = category_names.get(row[6])
+        if category_name is None:
+            continue  # Товар без существующей категории не показывается (как и при JOIN)
+        product = Product(row[0], row[1], row[2], row[3], row[4], row[5], category_name)
+        products[product.id] = product
+        products_by_category[category_name].append(product)
+    return CatalogSnapshot(
+        version,
+        tuple(category_names.values()),
+        {name: category_id for category_id, name in category_names.items()},
+        {name: tuple(items) for name, items in products_by_category.items()},
+        products,
+    )
+
+
+class Catalog:
+    """Кэш каталога, общий для всех потоков процесса.
+
+    fresh() без обращения к базе возвращает снимок, если версия сверялась недавно;
+    get(conn) при необходимости сверяет версию и перечитывает каталог.
+    """
+    def __init__(self, check_interval: float = CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self.reloads = 0
+        self._snapshot = None
+        self._checked_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def fresh(self):
+        """Возвращает снимок, если его версия сверялась не раньше check_interval секунд назад, иначе None."""
+        if time.monotonic() - self._checked_at < self.check_interval:
+            return self._snapshot
+        return None
+
+    def get(self, conn) -> CatalogSnapshot:
+        """Возвращает актуальный снимок каталога (перечитывает его, если версия в базе изменилась)."""
+        snapshot = self.fresh()
+        if snapshot is not None:
+            return snapshot
+        with self._lock:
+            snapshot = self.fresh()  # Другой поток мог уже проверить версию, пока мы ждали блокировку
+            if snapshot is not None:
+                return snapshot
+            if self._snapshot is None or self._snapshot.version != catalog_version(conn):
+                self._snapshot = load_snapshot(conn)
+                self.reloads += 1
+            self._checked_at = time.monotonic()
+            return self._snapshot
+
+    def invalidate(self):
+        """Требует сверить версию при следующем обращении (после изменения каталога в этом процессе)."""
+        self._checked_at = float("-inf")
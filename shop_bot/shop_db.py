@@ -0,0 +1,101 @@
+import asyncio
+import queue
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# Настройки базы данных (значения по умолчанию, боты могут переопределить их через .env)
+DB_PATH = 'db/shop.db'
+POOL_SIZE = 4  # Сколько соединений держать открытыми
+POOL_TIMEOUT = 10  # Сколько секунд ждать свободное соединение
+BUSY_TIMEOUT = 5  # Сколько секунд ждать, пока база занята записью в другом соединении
+MMAP_SIZE = 64 * 1024 * 1024  # Отображение файла базы в память, байт
+CACHE_SIZE_KIB = 16 * 1024  # Кэш страниц на соединение, КиБ
+
+
+def connect(path: str = DB_PATH) -> sqlite3.Connection:
+    """Открывает соединение с базой магазина и настраивает его один раз.
+
+    WAL позволяет читать параллельно с записью, synchronous=NORMAL в режиме WAL не делает fsync
+    на каждый commit, а mmap и увеличенный кэш страниц уменьшают число обращений к диску.
+    """
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KIB}")
+    return conn
+
+
+class ConnectionPool:
+    """Пул долгоживущих соединений с SQLite.
+
+    Соединения открываются один раз при старте и выдаются на время запроса через connection(),
+    вместо sqlite3.connect()/close() в каждой функции.
+    """
+    def __init__(self, path: str = DB_PATH, size: int = POOL_SIZE, timeout: float = POOL_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._pool = queue.LifoQueue(maxsize=size)  # LIFO: чаще используются «теплые» соединения
+        for _ in range(size):
+            self._pool.put(connect(path))
+
+    @contextmanager
+    def connection(self):
+        """Выдает соединение из пула и возвращает его обратно после использования."""
+        conn = self._pool.get(timeout=self.timeout)
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()  # Незавершенная транзакция (например, после ошибки) не должна попасть к следующему
+            self._pool.put(conn)
+
+    def close(self):
+        """Закрывает все соединения пула."""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class AsyncDatabase:
+    """Неблокирующий доступ к базе для асинхронного бота.
+
+    Запросы sqlite3 выполняются в отдельном пуле потоков (по потоку на соединение из пула),
+    поэтому обращение к диску не останавливает цикл событий и обработку других обновлений.
+    """
+    def __init__(self, pool: ConnectionPool):
+        self.pool = pool
+        self._executor = ThreadPoolExecutor(max_workers=pool.size, thread_name_prefix="shop_db")
+
+    async def run(self, fn, *args):
+        """Выполняет fn(conn, *args) в потоке БД с соединением из пула и возвращает результат."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, fn, args)
+
+    def _call(self, fn, args):
+        with self.pool.connection() as conn:
+            return fn(conn, *args)
+
+    async def fetchall(self, sql: str, params=()) -> list:
+        return await self.run(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def fetchone(self, sql: str, params=()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def execute(self, sql: str, params=()) -> int:
+        """Выполняет изменяющий запрос с commit и возвращает число затронутых строк."""
+        def execute(conn):
+            cursor = conn.execute(sql, params)
+            conn.commit()
+            return cursor.rowcount
+        return await self.run(execute)
+
+    def close(self):
+        """Дожидается выполняющихся запросов и закрывает соединения."""
+        self._executor.shutdown(wait=True)
+        self.pool.close()
@@ -0,0 +1,126 @@
+"""Запись избранного с группировкой (write-behind).
+
+Нажатия «Добавить в избранное» / «Удалить из избранного» ставятся в очередь, а отдельный поток
+записывает их пачками: все изменения, пришедшие за несколько миллисекунд, сохраняются одной
+транзакцией с одним commit. Каждое изменение задает итоговое состояние (в избранном или нет),
+поэтому повторное нажатие не создает дублей, а из нескольких нажатий на один товар
+записывается последнее.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from shop_db import DB_PATH, connect
+
+BATCH_WINDOW = 0.005  # Сколько секунд после первого изменения собирать остальные в ту же транзакцию
+MAX_BATCH = 500  # Наибольшее число изменений в одной транзакции
+
+
+def favorite_id_for_user(conn, user_id) -> int:
+    """Возвращает id избранного пользователя, создавая избранное при необходимости (внутри транзакции)."""
+    row = conn.execute("SELECT favorite_id FROM users WHERE id = ?", (user_id,)).fetchone()
+    if row:
+        return row[0]
+    favorite_id = conn.execute("INSERT INTO favorites DEFAULT VALUES").lastrowid
+    conn.execute("INSERT INTO users (id, favorite_id) VALUES (?, ?)", (user_id, favorite_id))
+    return favorite_id
+
+
+class FavoritesWriter:
+    """Очередь изменений избранного с записью пачками в отдельном потоке."""
+    def __init__(self, path: str = DB_PATH, window: float = BATCH_WINDOW, max_batch: int = MAX_BATCH):
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0  # Сколько транзакций записано
+        self.writes = 0  # Сколько изменений записано (после объединения повторов)
+        self._conn = connect(path)
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="favorites_writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, user_id, product_id, in_favorites: bool) -> Future:
+        """Ставит в очередь добавление (in_favorites=True) или удаление товара из избранного.
+
+        Future завершается после commit и содержит сохраненное состояние: находится ли товар в избранном.
+        """
+        future = Future()
+        self._queue.put((user_id, product_id, in_favorites, future))
+        return future
+
+    def close(self):
+        """Записывает изменения, оставшиеся в очереди, и останавливает поток."""
+        self._queue.put(None)
+        self._thread.join()
+        self._conn.close()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = []
+            self._add(batch, item)
+            stopping = False
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                self._add(batch, item)
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    # Ошибка одной пачки не должна останавливать поток: иначе следующие изменения не запишутся никогда
+                    print(f"Ошибка записи избранного: {e}")
+                    for *_, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+            if stopping:
+                return
+
+    @staticmethod
+    def _add(batch, item):
+        """Добавляет изменение в пачку, если его не отменили (например, отменен ожидавший его обработчик)."""
+        if item[3].set_running_or_notify_cancel():
+            batch.append(item)
+
+    def _write(self, batch):
+        states = {}  # (user_id, product_id) -> итоговое состояние
+        for user_id, product_id, in_favorites, _ in batch:
+            states[(user_id, product_id)] = in_favorites
+
+        conn = self._conn
+        try:
+            # IMMEDIATE: блокировка записи берется сразу, и создание избранного не гоняется с другим процессом
+            conn.execute("BEGIN IMMEDIATE")
+            favorite_ids = {}
+            for (user_id, product_id), in_favorites in states.items():
+                favorite_id = favorite_ids.get(user_id)
+                if favorite_id is None:
+                    favorite_id = favorite_ids[user_id] = favorite_id_for_user(conn, user_id)
+                if in_favorites:
+                    conn.execute('''
+                        INSERT INTO favorite_items (favorite_id, product_id) VALUES (?, ?)
+                        ON CONFLICT (favorite_id, product_id) DO NOTHING
+                    ''', (favorite_id, product_id))
+                else:
+                    conn.execute("DELETE FROM favorite_items WHERE favorite_id = ? AND product_id = ?",
+                                 (favorite_id, product_id))
+            conn.commit()
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            for *_, future in batch:
+                future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.writes += len(states)
+        for user_id, product_id, _, future in batch:
+            future.set_result(states[(user_id, product_id)])
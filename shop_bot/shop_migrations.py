@@ -0,0 +1,156 @@
+"""Версионированные миграции схемы shop.db.
+
+Номер примененной миграции хранится в PRAGMA user_version. Каждая миграция выполняется
+в одной транзакции вместе с увеличением версии, поэтому при ошибке база остается в прежнем
+состоянии, а при следующем запуске миграция повторяется. Скрипты идемпотентны (IF NOT EXISTS),
+так что одновременный запуск двух ботов на одной базе безопасен.
+
+Проверка: python shop_migrations.py [путь_к_базе] - применяет миграции и выводит планы горячих
+запросов; код возврата 1, если какой-то из них читает таблицу целиком (SCAN).
+"""
+import sqlite3
+import sys
+
+from shop_db import DB_PATH
+
+_CATALOG_VERSION_TRIGGER = '''
+    CREATE TRIGGER IF NOT EXISTS {table}_{event}_catalog_version AFTER {event} ON {table}
+    BEGIN
+        UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+    END;
+'''
+
+
+def _fold(column: str) -> str:
+    """SQL-выражение: значение столбца с «ё» -> «е» (так же, как shop_search.fold для запросов)."""
+    return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+_FTS_VALUES = "{prefix}.id, " + _fold("{prefix}.name") + ", " + _fold("{prefix}.description")
+
+MIGRATIONS = [
+    # 1. Версия каталога: триггеры увеличивают ее при любом изменении категорий и товаров (см. shop_catalog.py)
+    '''
+    CREATE TABLE IF NOT EXISTS catalog_version (
+        id      INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    );
+    INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0);
+    ''' + "".join(
+        _CATALOG_VERSION_TRIGGER.format(table=table, event=event)
+        for table in ("categories", "products")
+        for event in ("INSERT", "UPDATE", "DELETE")
+    ),
+    # 2. Индексы для горячих запросов. Повторы в избранном удаляются, чтобы создать UNIQUE-индекс:
+    # после него добавление в избранное - один INSERT ... ON CONFLICT DO NOTHING вместо SELECT и INSERT.
+    '''
+    DELETE FROM favorite_items
+    WHERE id NOT IN (SELECT MIN(id) FROM favorite_items GROUP BY favorite_id, product_id);
+    CREATE UNIQUE INDEX IF NOT EXISTS favorite_items_favorite_product ON favorite_items (favorite_id, product_id);
+    CREATE INDEX IF NOT EXISTS products_category_name ON products (category_id, name);
+    ''',
+    # 3. Полнотекстовый поиск по названию и описанию товаров (см. shop_search.py). Индекс хранится
+    # без копии данных (content=''), «ё» заменяется на «е»: unicode61 не считает их одной буквой.
+    # Префиксы до 6 букв индексируются отдельно, чтобы поиск по началу слова не перебирал все слова.
+    f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5 (
+        name, description, content='', tokenize='unicode61 remove_diacritics 2', prefix='1 2 3 4 5 6'
+    );
+    INSERT INTO products_fts (products_fts) VALUES ('delete-all');
+    INSERT INTO products_fts (rowid, name, description)
+        SELECT {_FTS_VALUES.format(prefix="products")} FROM products;
+    CREATE TRIGGER IF NOT EXISTS products_insert_fts AFTER INSERT ON products
+    BEGIN
+        INSERT INTO products_fts (rowid, name, description) VALUES ({_FTS_VALUES.format(prefix="new")});
+    END;
+    CREATE TRIGGER IF NOT EXISTS products_delete_fts AFTER DELETE ON products
+    BEGIN
+        INSERT INTO products_fts (products_fts, rowid, name, description)
+            VALUES ('delete', {_FTS_VALUES.format(prefix="old")});
+    END;
+    CREATE TRIGGER IF NOT EXISTS products_update_fts AFTER UPDATE OF id, name, description ON products
+    BEGIN
+        INSERT INTO products_fts (products_fts, rowid, name, description)
+            VALUES ('delete', {_FTS_VALUES.format(prefix="old")});
+        INSERT INTO products_fts (rowid, name, description) VALUES ({_FTS_VALUES.format(prefix="new")});
+    END;
+    ''',
+    # 4. Релевантность поиска по умолчанию (ORDER BY rank): BM25, совпадение в названии в 10 раз весомее описания
+    '''
+    INSERT INTO products_fts (products_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)');
+    ''',
+]
+
+# Запросы, которые выполняются на каждое действие пользователя (параметры для EXPLAIN QUERY PLAN)
+HOT_QUERIES = [
+    ("SELECT favorite_id FROM users WHERE id = ?", (1,)),
+    ("SELECT id FROM admins WHERE id = ?", (1,)),
+    ("SELECT version FROM catalog_version WHERE id = 1", ()),
+    ('''SELECT EXISTS (
+            SELECT 1
+            FROM users
+            JOIN favorite_items ON favorite_items.favorite_id = users.favorite_id
+            WHERE users.id = ? AND favorite_items.product_id = ?
+        )''', (1, 1)),
+    ('''INSERT INTO favorite_items (favorite_id, product_id) VALUES (?, ?)
+        ON CONFLICT (favorite_id, product_id) DO NOTHING''', (1, 1)),
+    ("DELETE FROM favorite_items WHERE favorite_id = ? AND product_id = ?", (1, 1)),
+    ('''SELECT products.id, products.name
+        FROM favorite_items
+        JOIN products ON favorite_items.product_id = products.id
+        WHERE favorite_items.favorite_id = ?''', (1,)),
+    ('''SELECT products.id, products.name
+        FROM products JOIN categories ON products.category_id = categories.id
+        WHERE categories.name = ?''', ("",)),
+    ("SELECT count(*) FROM (SELECT 1 FROM products_fts WHERE products_fts MATCH ? LIMIT ?)", ('"товар"*', 1001)),
+    ("SELECT rowid FROM products_fts WHERE products_fts MATCH ? ORDER BY rank LIMIT ?", ('"товар"*', 20)),
+    ('''SELECT rowid FROM (SELECT rowid, rank FROM products_fts WHERE products_fts MATCH ? LIMIT ?)
+        ORDER BY rank LIMIT ?''', ('name : ("товар"*)', 1000, 20)),
+]
+
+
+def schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn) -> int:
+    """Применяет недостающие миграции и возвращает версию схемы."""
+    if conn.in_transaction:
+        conn.commit()
+    for number in range(schema_version(conn) + 1, len(MIGRATIONS) + 1):
+        try:
+            # BEGIN IMMEDIATE: второй процесс дождется окончания миграции, а не упадет на записи
+            conn.executescript(f"BEGIN IMMEDIATE; {MIGRATIONS[number - 1]} PRAGMA user_version = {number}; COMMIT;")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+    return schema_version(conn)
+
+
+def full_scans(conn) -> list:
+    """Возвращает пары (запрос, шаг плана) для горячих запросов, которые читают таблицу целиком."""
+    scans = []
+    for sql, params in HOT_QUERIES:
+        for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params):
+            step = row[3]
+            # Не полное чтение таблицы: CONSTANT ROW - SELECT без таблицы, VIRTUAL TABLE - поиск по индексу
+            # FTS5 (MATCH), subquery - перебор уже ограниченного результата подзапроса
+            if (step.startswith("SCAN") and step != "SCAN CONSTANT ROW" and "VIRTUAL TABLE" not in step
+                    and not step.startswith("SCAN (subquery")):
+                scans.append((" ".join(sql.split()), step))
+    return scans
+
+
+if __name__ == "__main__":
+    conn = sqlite3.connect(sys.argv[1] if len(sys.argv) > 1 else DB_PATH)
+    print(f"Версия схемы: {migrate(conn)}")
+    for sql, params in HOT_QUERIES:
+        print(" ".join(sql.split()))
+        for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params):
+            print(f"    {row[3]}")
+    scans = full_scans(conn)
+    conn.close()
+    for sql, step in scans:
+        print(f"Полное чтение таблицы: {step} в запросе {sql}")
+    sys.exit(1 if scans else 0)
@@ -0,0 +1,70 @@
+"""Полнотекстовый поиск товаров по индексу products_fts (FTS5, см. shop_migrations.py)."""
+import re
+
+SEARCH_LIMIT = 20  # Сколько товаров показывать в результатах поиска
+SEARCH_CANDIDATES = 1000  # Запрос с большим числом совпадений ранжируется по ограниченному набору (см. search_product_ids)
+MIN_WORD_LENGTH = 2  # Более короткие слова (кроме чисел) не ищутся: одна буква подходит почти ко всем товарам
+MAX_PREFIX_LENGTH = 6  # Длина префиксов в индексе: более длинные слова ищутся по первым 6 буквам
+MAX_QUERY_WORDS = 8
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def fold(text: str) -> str:
+    """«ё» -> «е», как в индексе."""
+    return text.replace("ё", "е").replace("Ё", "Е")
+
+
+def fts_query(text: str) -> str:
+    """Превращает текст пользователя в запрос FTS5: все слова обязательны, каждое - как начало слова.
+
+    Слова берутся в кавычки, поэтому операторы FTS5 (AND, NEAR, *, ...) во вводе ничего не ломают.
+    Слово обрезается до MAX_PREFIX_LENGTH букв: такой префикс есть в индексе и ищется без перебора
+    слов, а заодно находятся другие формы слова («игрушки» -> «игрушк*» -> «игрушка»).
+    Слова короче MIN_WORD_LENGTH букв пропускаются, числа остаются.
+    """
+    words = [word for word in _WORD_RE.findall(fold(text)) if len(word) >= MIN_WORD_LENGTH or word.isdigit()]
+    words = words[:MAX_QUERY_WORDS]
+    return " ".join(f'"{word[:MAX_PREFIX_LENGTH]}"*' for word in words)
+
+
+def _ranked(conn, query: str, limit: int) -> list:
+    """Все совпадения, упорядоченные по rank (BM25, название весомее описания, см. shop_migrations.py)."""
+    rows = conn.execute(
+        "SELECT rowid FROM products_fts WHERE products_fts MATCH ? ORDER BY rank LIMIT ?", (query, limit)
+    ).fetchall()
+    return [row[0] for row in rows]
+
+
+def _ranked_candidates(conn, query: str, limit: int) -> list:
+    """Первые SEARCH_CANDIDATES совпадений, упорядоченные по rank: BM25 считается не больше чем для них."""
+    rows = conn.execute('''
+        SELECT rowid FROM (SELECT rowid, rank FROM products_fts WHERE products_fts MATCH ? LIMIT ?)
+        ORDER BY rank LIMIT ?
+    ''', (query, SEARCH_CANDIDATES, limit)).fetchall()
+    return [row[0] for row in rows]
+
+
+def search_product_ids(conn, text: str, limit: int = SEARCH_LIMIT) -> list:
+    """Возвращает id товаров, подходящих под запрос, от самых релевантных.
+
+    Если совпадений не больше SEARCH_CANDIDATES, ранжируются все. Широкий запрос (например, слово
+    из названий всех товаров) ранжировал бы весь каталог на каждое нажатие клавиши в inline-режиме,
+    поэтому для него BM25 считается по ограниченному набору: сначала товары, у которых запрос
+    найден в названии, затем, если их не хватило, - любые совпадения.
+    """
+    query = fts_query(text)
+    if not query:
+        return []
+    matches = conn.execute(
+        "SELECT count(*) FROM (SELECT 1 FROM products_fts WHERE products_fts MATCH ? LIMIT ?)",
+        (query, SEARCH_CANDIDATES + 1)
+    ).fetchone()[0]
+    if matches <= SEARCH_CANDIDATES:
+        return _ranked(conn, query, limit)
+    product_ids = _ranked_candidates(conn, f"name : ({query})", limit)
+    if len(product_ids) < limit:
+        found = set(product_ids)
+        product_ids += [product_id for product_id in _ranked_candidates(conn, query, limit + len(found))
+                        if product_id not in found][:limit - len(product_ids)]
+    return product_ids
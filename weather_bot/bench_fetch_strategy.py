@@ -0,0 +1,75 @@
+"""Сравнение стратегий запросов к OpenWeatherMap: число вызовов API и задержка на один ответ.
+
+OpenWeatherMap имитируется с фиксированной задержкой, поэтому ключ API и сеть не нужны.
+Кэши погоды очищаются перед каждым ответом (как после истечения TTL), координаты города остаются
+в постоянном кэше, как у работающего бота.
+
+Запуск: python bench_fetch_strategy.py [число_ответов] [задержка_API_в_мс]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:benchmark")
+os.environ.setdefault("OPENWEATHERMAP_API_KEY", "benchmark")
+# Базы бота - во временном каталоге: импорт weather_async создает их и не должен трогать db/
+DB_DIR = tempfile.mkdtemp()
+os.environ["OWM_GEOCODE_DB"] = os.path.join(DB_DIR, "geocode.db")
+os.environ["SUBSCRIPTIONS_DB"] = os.path.join(DB_DIR, "subscriptions.db")
+
+import weather_async  # noqa: E402
+
+CITY = "Москва"
+
+
+def fake_response(path, params):
+    """Возвращает ответ, похожий на ответ OpenWeatherMap."""
+    main = {"temp": 1.5, "feels_like": -1.0, "pressure": 1013, "humidity": 80, "temp_min": 0.5, "temp_max": 2.5}
+    weather = [{"id": 803, "description": "облачно с прояснениями"}]
+    if path == "/data/2.5/weather":
+        return {"cod": 200, "dt": 1700000000, "timezone": 10800, "main": main, "weather": weather,
+                "wind": {"speed": 3.0}, "visibility": 10000}
+    if path == "/geo/1.0/direct":
+        return [{"name": "Moscow", "local_names": {"ru": CITY}, "lat": 55.75, "lon": 37.62}]
+    return {
+        "list": [{"dt": 1700000000 + 10800 * i, "main": main, "weather": weather, "wind": {"speed": 3.0},
+                  "visibility": 10000, "pop": 0.2, "dt_txt": ""} for i in range(40)],
+        "city": {"name": "Moscow", "timezone": 10800},
+    }
+
+
+async def run(strategy: str, replies: int, latency: float):
+    calls = 0
+
+    async def fake_fetch_owm(path, **params):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(latency)
+        return fake_response(path, params)
+
+    weather_async.fetch_owm = fake_fetch_owm
+    weather_async.OWM_FETCH_STRATEGY = strategy
+    await weather_async.fetch_weather_data(CITY)  # Первый запрос заполняет кэш координат
+
+    calls = 0
+    started = time.perf_counter()
+    for _ in range(replies):
+        weather_async.current_cache._data.clear()
+        weather_async.forecast_cache._data.clear()
+        await weather_async.fetch_weather_data(CITY)
+    elapsed = time.perf_counter() - started
+    print(f"{strategy:>8}: {calls / replies:.1f} запросов к API на ответ, {elapsed / replies * 1000:.1f} мс на ответ")
+
+
+async def main():
+    replies = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    latency = (float(sys.argv[2]) if len(sys.argv) > 2 else 80) / 1000
+    for strategy in ("full", "forecast"):
+        await run(strategy, replies, latency)
+    weather_async.geocode_store.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,15 +1,33 @@
 import asyncio
+import math
 import os
+import random
+import time
 from dotenv import load_dotenv
-import pytz
-from datetime import datetime
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import CommandStart, Command
+from aiogram.filters import CommandStart, Command, CommandObject
 from aiogram.enums import ParseMode
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
-from aiogram.exceptions import TelegramBadRequest
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.utils.keyboard import InlineKeyboardBuilder
 import aiohttp
 
+from weather_time import city_timezone, format_age, format_local_time, register_city_timezone
+from weather_parse import parse_current, parse_forecast, split_forecast
+from weather_forecast import CALLBACK_PREFIX, daily_summaries, format_forecast_day, pager_callback, parse_pager_callback
+from weather_limits import (
+    RateLimiter, RateLimited, CircuitBreaker, CircuitOpen,
+    CALLS_PER_MINUTE, MAX_QUEUE_WAIT, DAILY_QUOTA, FAILURE_THRESHOLD, SLOW_CALL_THRESHOLD, RESET_TIMEOUT,
+)
+from weather_subscriptions import (
+    SubscriptionStore, parse_subscribe_args, MINUTES_PER_DAY, SUBSCRIPTIONS_DB_PATH, TELEGRAM_MESSAGES_PER_SECOND,
+)
+from weather_gazetteer import Gazetteer, city_callback, looks_like_city, CITY_CALLBACK_PREFIX, GAZETTEER_PATH
+from weather_cache import (
+    TTLCache, GeocodeStore, HotCities, CityNotFound, normalize_city, place_from_geo,
+    CURRENT_WEATHER_TTL, FORECAST_TTL, CACHE_MAX_SIZE, GEOCODE_DB_PATH, GEOCODE_NEGATIVE_TTL,
+)
+
 # Загружаем переменные окружения из .env файла
 load_dotenv()
 
@@ -21,30 +39,138 @@ if not BOT_TOKEN or not OPENWEATHERMAP_API_KEY:
     print("Ошибка: Необходимы переменные окружения TELEGRAM_BOT_TOKEN и OPENWEATHERMAP_API_KEY.")
     exit()
 
+# Настройки HTTP-клиента для OpenWeatherMap (можно переопределить через .env)
+OWM_BASE_URL = "http://api.openweathermap.org"
+OWM_POOL_LIMIT = int(os.environ.get("OWM_POOL_LIMIT", 100))  # Всего соединений в пуле
+OWM_POOL_LIMIT_PER_HOST = int(os.environ.get("OWM_POOL_LIMIT_PER_HOST", 20))  # Соединений на один хост
+OWM_KEEPALIVE_TIMEOUT = float(os.environ.get("OWM_KEEPALIVE_TIMEOUT", 30))  # Сколько держать простаивающее соединение, с
+OWM_CONNECT_TIMEOUT = float(os.environ.get("OWM_CONNECT_TIMEOUT", 3))  # Таймаут на установку соединения, с
+OWM_READ_TIMEOUT = float(os.environ.get("OWM_READ_TIMEOUT", 5))  # Таймаут на чтение ответа, с
+OWM_TOTAL_TIMEOUT = float(os.environ.get("OWM_TOTAL_TIMEOUT", 10))  # Общий таймаут запроса, с
+
+# Настройки кэша ответов OpenWeatherMap
+OWM_CURRENT_TTL = float(os.environ.get("OWM_CURRENT_TTL", CURRENT_WEATHER_TTL))
+OWM_FORECAST_TTL = float(os.environ.get("OWM_FORECAST_TTL", FORECAST_TTL))
+OWM_CACHE_SIZE = int(os.environ.get("OWM_CACHE_SIZE", CACHE_MAX_SIZE))
+OWM_GEOCODE_DB = os.environ.get("OWM_GEOCODE_DB", GEOCODE_DB_PATH)
+OWM_GEOCODE_NEGATIVE_TTL = float(os.environ.get("OWM_GEOCODE_NEGATIVE_TTL", GEOCODE_NEGATIVE_TTL))
+GAZETTEER_FILE = os.environ.get("GAZETTEER_FILE", GAZETTEER_PATH)  # Локальный справочник городов
+
+# Ограничение частоты запросов к OpenWeatherMap
+OWM_CALLS_PER_MINUTE = float(os.environ.get("OWM_CALLS_PER_MINUTE", CALLS_PER_MINUTE))
+OWM_MAX_QUEUE_WAIT = float(os.environ.get("OWM_MAX_QUEUE_WAIT", MAX_QUEUE_WAIT))
+OWM_DAILY_QUOTA = int(os.environ.get("OWM_DAILY_QUOTA", DAILY_QUOTA))
+
+# Предохранитель: при недоступности OpenWeatherMap бот сразу отвечает последними известными данными
+OWM_FAILURE_THRESHOLD = int(os.environ.get("OWM_FAILURE_THRESHOLD", FAILURE_THRESHOLD))
+OWM_SLOW_CALL_THRESHOLD = float(os.environ.get("OWM_SLOW_CALL_THRESHOLD", SLOW_CALL_THRESHOLD))
+OWM_RESET_TIMEOUT = float(os.environ.get("OWM_RESET_TIMEOUT", RESET_TIMEOUT))
+
+# Стратегия запросов: "full" - текущая погода, геокодинг и прогноз (3 запроса);
+# "forecast" - для городов с известными координатами все берется из одного ответа /forecast
+OWM_FETCH_STRATEGY = os.environ.get("OWM_FETCH_STRATEGY", "full")
+
+# Города на клавиатуре (по ним идет основной трафик)
+KEYBOARD_CITIES = [
+    ["Москва", "Санкт-Петербург", "Минск"],
+    ["Екатеринбург", "Казань", "Нижний Новгород"],
+    ["Челябинск", "Омск", "Самара", "Ростов-на-Дону"],
+]
+
+# Настройки фонового прогрева кэша
+OWM_HOT_CITIES = [city.strip() for city in os.environ.get(
+    "OWM_HOT_CITIES", ",".join(city for row in KEYBOARD_CITIES for city in row)
+).split(",") if city.strip()]
+OWM_HOT_CITIES_MAX = int(os.environ.get("OWM_HOT_CITIES_MAX", 20))  # Сколько всего городов прогревать
+OWM_PREWARM_INTERVAL = float(os.environ.get("OWM_PREWARM_INTERVAL", 540))  # Чуть меньше OWM_CURRENT_TTL
+OWM_PREWARM_JITTER = float(os.environ.get("OWM_PREWARM_JITTER", 30))  # Случайный сдвиг, чтобы не бить в API ровно по таймеру
+
+# Подписки на ежедневный прогноз
+SUBSCRIPTIONS_DB = os.environ.get("SUBSCRIPTIONS_DB", SUBSCRIPTIONS_DB_PATH)
+SEND_MESSAGES_PER_SECOND = float(os.environ.get("SEND_MESSAGES_PER_SECOND", TELEGRAM_MESSAGES_PER_SECOND))
+
+# Чаты, которым доступна служебная команда /stats (id через запятую); по умолчанию - никому
+STATS_CHAT_IDS = {int(chat_id) for chat_id in os.environ.get("STATS_CHAT_IDS", "").split(",") if chat_id.strip()}
+
+# Inline-режим (@бот <город>)
+INLINE_DEBOUNCE = float(os.environ.get("INLINE_DEBOUNCE", 0.4))  # Пауза после ввода, прежде чем отвечать, с
+INLINE_RESULTS = int(os.environ.get("INLINE_RESULTS", 3))  # Сколько городов показывать
+INLINE_RESULT_TTL = float(os.environ.get("INLINE_RESULT_TTL", 60))  # Сколько хранить готовые карточки, с
+INLINE_CACHE_TIME = int(os.environ.get("INLINE_CACHE_TIME", 300))  # Сколько Telegram кэширует ответ на запрос, с
+
 # Инициализируем бот и диспетчер
 bot = Bot(token=BOT_TOKEN)
 dp = Dispatcher()
 
+# Кэши текущей погоды и прогноза (ключ - нормализованное название города)
+current_cache = TTLCache(ttl=OWM_CURRENT_TTL, maxsize=OWM_CACHE_SIZE)
+forecast_cache = TTLCache(ttl=OWM_FORECAST_TTL, maxsize=OWM_CACHE_SIZE)
+# Готовые карточки inline-режима: (текст сообщения, краткое описание) для города
+inline_cache = TTLCache(ttl=INLINE_RESULT_TTL, maxsize=OWM_CACHE_SIZE)
+inline_latest = {}  # id пользователя -> id его последнего inline-запроса (для debounce)
+# Справочник городов: исправление опечаток и координаты без запросов к геокодеру
+gazetteer = Gazetteer.load(GAZETTEER_FILE)
+for known_city in gazetteer.cities:
+    register_city_timezone(known_city.name, known_city.timezone)
+# Постоянный кэш координат: повторные запросы города не обращаются к геокодеру
+geocode_store = GeocodeStore(OWM_GEOCODE_DB, negative_ttl=OWM_GEOCODE_NEGATIVE_TTL)
+# Общий для всех запросов к OpenWeatherMap ограничитель частоты и счетчик суточной квоты
+rate_limiter = RateLimiter(OWM_CALLS_PER_MINUTE, max_wait=OWM_MAX_QUEUE_WAIT, daily_quota=OWM_DAILY_QUOTA)
+circuit_breaker = CircuitBreaker(OWM_FAILURE_THRESHOLD, OWM_SLOW_CALL_THRESHOLD, OWM_RESET_TIMEOUT)
+revalidations = {}  # ключ города -> фоновая задача обновления кэша
+# Статистика запросов городов для прогрева кэша
+hot_cities = HotCities(OWM_HOT_CITIES, max_size=OWM_HOT_CITIES_MAX)
+
+# Подписки и очередь рассылки (ограничена общим лимитом Telegram на отправку сообщений)
+subscription_store = SubscriptionStore(SUBSCRIPTIONS_DB)
+send_limiter = RateLimiter(SEND_MESSAGES_PER_SECOND * 60, max_wait=60, burst=SEND_MESSAGES_PER_SECOND)
+send_queue = None  # asyncio.Queue, создается в main()
+
+# Общая HTTP-сессия для всех запросов к OpenWeatherMap (создается в main())
+http_session = None
+
+def create_http_session():
+    """Создает долгоживущую HTTP-сессию с пулом keep-alive соединений."""
+    connector = aiohttp.TCPConnector(
+        limit=OWM_POOL_LIMIT,
+        limit_per_host=OWM_POOL_LIMIT_PER_HOST,
+        keepalive_timeout=OWM_KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=300,  # Кэшируем DNS, чтобы не резолвить хост на каждый запрос
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=OWM_TOTAL_TIMEOUT,
+        sock_connect=OWM_CONNECT_TIMEOUT,
+        sock_read=OWM_READ_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+async def fetch_owm(path: str, **params):
+    """Выполняет GET-запрос к OpenWeatherMap через общую сессию и возвращает JSON."""
+    circuit_breaker.before_call()
+    await rate_limiter.acquire_async()
+    params["appid"] = OPENWEATHERMAP_API_KEY
+    started = time.monotonic()
+    try:
+        async with http_session.get(f"{OWM_BASE_URL}{path}", params=params) as response:
+            if response.status == 429:
+                raise RateLimited("OpenWeatherMap вернул 429 Too Many Requests")
+            response.raise_for_status() # Проверяем на ошибки
+            data = await response.json()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        # Ответы 4xx (например, 404 для неизвестного города) - не признак недоступности сервиса
+        if isinstance(e, aiohttp.ClientResponseError) and e.status < 500:
+            circuit_breaker.record_success(time.monotonic() - started)
+        else:
+            circuit_breaker.record_failure()
+        raise
+    circuit_breaker.record_success(time.monotonic() - started)
+    return data
+
 # Функция для создания клавиатуры
 def create_keyboard():
     """Создает клавиатуру с кнопками."""
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True, keyboard=[
-        [
-            types.KeyboardButton(text="Москва"),
-            types.KeyboardButton(text="Санкт-Петербург"),
-            types.KeyboardButton(text="Минск")
-        ],
-        [
-            types.KeyboardButton(text="Екатеринбург"),
-            types.KeyboardButton(text="Казань"),
-            types.KeyboardButton(text="Нижний Новгород")
-        ],
-        [
-            types.KeyboardButton(text="Челябинск"),
-            types.KeyboardButton(text="Омск"),
-            types.KeyboardButton(text="Самара"),
-            types.KeyboardButton(text="Ростов-на-Дону")
-        ]
+        [types.KeyboardButton(text=city) for city in row] for row in KEYBOARD_CITIES
     ])
     return markup
 
@@ -62,6 +188,9 @@ async def command_start_handler(message: types.Message) -> None:
         "Я бот погоды. Выберите город или отправьте мне его название.\n\n"
         "Доступные команды:\n"
         "/start - начать работу\n"
+        "/forecast <город> - прогноз на 5 дней\n"
+        "/subscribe <город> <ЧЧ:ММ> - ежедневный прогноз\n"
+        "/unsubscribe [город] - отменить подписку\n"
         "/help - получить справку",
         reply_markup=markup
     )
@@ -72,91 +201,225 @@ async def command_help_handler(message: types.Message) -> None:
 
     await message.answer(
         f"Я бот погоды. Выберите город или отправьте его название.\n"
+        "Прогноз на 5 дней по дням: /forecast <город>\n"
+        "Ежедневный прогноз: /subscribe <город> <ЧЧ:ММ>, отмена: /unsubscribe [город]"
+    )
+
+async def gather_or_cancel(*aws):
+    """Выполняет корутины параллельно; при первой ошибке отменяет остальные и пробрасывает ее."""
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()
+        raise
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)  # Дожидаемся отмены, чтобы не оставлять висящих задач
+    error = None
+    for task in tasks:
+        if task.done() and not task.cancelled() and task.exception() is not None:
+            error = error or task.exception()  # Забираем все ошибки, но пробрасываем первую
+    if error is not None:
+        raise error
+    return [task.result() for task in tasks]
+
+async def resolve_city(city: str):
+    """Возвращает координаты города из справочника, постоянного кэша или запрашивает их у геокодера."""
+    known = gazetteer.get(city)
+    if known is not None:
+        return known.place
+    key = normalize_city(city)
+    place = geocode_store.get(key)
+    if place is None:
+        geo_data = await fetch_owm("/geo/1.0/direct", q=city, limit=1)
+        try:
+            place = place_from_geo(geo_data)
+        except CityNotFound:
+            geocode_store.put_not_found(key)
+            raise
+        geocode_store.put(key, place)
+    return place
+
+async def fetch_current(city: str):
+    """Запрашивает текущую погоду (404 от API запоминается как ненайденный город)."""
+    known = gazetteer.get(city)
+    location = {"lat": known.lat, "lon": known.lon} if known is not None else {"q": city}
+    try:
+        current_data = await fetch_owm("/data/2.5/weather", units="metric", lang="ru", **location)
+    except aiohttp.ClientResponseError as e:
+        if e.status == 404:
+            geocode_store.put_not_found(normalize_city(city))
+            raise CityNotFound(city) from e
+        raise
+    return parse_current(current_data)
+
+async def fetch_forecast(city: str):
+    """Получает координаты города и запрашивает прогноз по ним."""
+    place = await resolve_city(city)
+    forecast_data = await fetch_owm("/data/2.5/forecast", lat=place.lat, lon=place.lon, units="metric", lang="ru")
+    return parse_forecast(forecast_data)
+
+async def get_forecast(city: str):
+    """Возвращает прогноз города из кэша (при исчерпании лимита - устаревший)."""
+    key = normalize_city(city)
+    geocode_store.get(key)  # Город, который недавно не нашелся, сразу отсекаем без запросов к API
+    try:
+        return await forecast_cache.get_or_fetch_async(key, lambda: fetch_forecast(city))
+    except RateLimited:
+        forecast = forecast_cache.get_stale(key)
+        if forecast is None:
+            raise
+        return forecast
+
+def stale_weather_data(key: str):
+    """Возвращает последние известные данные города: (текущая погода, прогноз, возраст в секундах) или None."""
+    current, forecast = current_cache.get_stale(key), forecast_cache.get_stale(key)
+    if forecast is None:
+        return None
+    if current is None:
+        # Текущей погоды в кэше нет (стратегия "forecast"): берем ближайший слот прогноза
+        current, forecast = split_forecast(forecast)
+        return current, forecast, forecast_cache.age(key)
+    return current, forecast, current_cache.age(key)
+
+def revalidate_in_background(key: str, city: str):
+    """Запускает фоновое обновление кэша города (одно на город), не заставляя пользователя ждать."""
+    if key in revalidations:
+        return
+    task = asyncio.create_task(prewarm_city(key, city, horizon=math.inf))
+    revalidations[key] = task
+    task.add_done_callback(lambda t: revalidation_done(key, t))
+
+def revalidation_done(key: str, task: asyncio.Task):
+    revalidations.pop(key, None)
+    if not task.cancelled() and task.exception() is not None and not isinstance(task.exception(), CircuitOpen):
+        print(f"Ошибка при фоновом обновлении кэша для города {key}: {task.exception()}")
+
+async def fetch_weather_data(city: str):
+    """Параллельно запрашивает текущую погоду и цепочку геокодинг -> прогноз (с кэшированием).
+
+    Возвращает (текущая погода, прогноз, возраст данных): возраст в секундах, если сервис
+    недоступен и отданы устаревшие данные из кэша, иначе None.
+    """
+    key = normalize_city(city)
+    known = gazetteer.get(city)
+    # Город, который недавно не нашелся, сразу отсекаем без запросов к API
+    place = known.place if known is not None else geocode_store.get(key)
+    if circuit_breaker.is_open:
+        # Сервис недоступен: сразу отвечаем последними известными данными, а кэш обновляем в фоне
+        stale = stale_weather_data(key)
+        if stale is not None:
+            revalidate_in_background(key, city)
+            return stale
 
+    try:
+        if OWM_FETCH_STRATEGY == "forecast" and place is not None:
+            # Координаты известны: текущая погода и прогноз берутся из одного ответа /forecast
+            current, forecast = split_forecast(await forecast_cache.get_or_fetch_async(key, lambda: fetch_forecast(city)))
+        else:
+            current, forecast = await gather_or_cancel(
+                current_cache.get_or_fetch_async(key, lambda: fetch_current(city)),
+                forecast_cache.get_or_fetch_async(key, lambda: fetch_forecast(city)),
+            )
+    except (RateLimited, aiohttp.ClientError, asyncio.TimeoutError) as e:
+        # Лимит запросов исчерпан или сервис недоступен: отдаем устаревшие данные из кэша, если они есть
+        if isinstance(e, aiohttp.ClientResponseError) and e.status < 500:
+            raise
+        stale = stale_weather_data(key)
+        if stale is None:
+            raise
+        return stale
+    if current.timezone is not None:
+        geocode_store.set_timezone(key, current.timezone)
+    return current, forecast, None
+
+async def prewarm_city(key: str, city: str, horizon: float):
+    """Обновляет кэш города, если запись устареет раньше следующего прохода."""
+    fetches = []
+    if OWM_FETCH_STRATEGY != "forecast" and current_cache.expires_in(key) < horizon:
+        fetches.append(current_cache.refresh_async(key, lambda: fetch_current(city)))
+    if forecast_cache.expires_in(key) < horizon:
+        fetches.append(forecast_cache.refresh_async(key, lambda: fetch_forecast(city)))
+    await asyncio.gather(*fetches)
+
+async def prewarm_loop():
+    """Фоновая задача: периодически прогревает кэш для популярных городов.
+
+    Города прогреваются по одному, равномерно в течение прохода: все сразу (и при запуске, когда
+    кэш пуст) они выбрали бы всплеск ограничителя частоты, и запросы пользователей получали бы RateLimited.
+    """
+    horizon = OWM_PREWARM_INTERVAL + OWM_PREWARM_JITTER
+    while True:
+        interval = OWM_PREWARM_INTERVAL + random.uniform(-OWM_PREWARM_JITTER, OWM_PREWARM_JITTER)
+        cities = hot_cities.current()
+        if not cities:
+            await asyncio.sleep(interval)
+            continue
+        step = interval / len(cities)
+        for key, city in cities.items():
+            started = time.monotonic()
+            try:
+                await prewarm_city(key, city, horizon)
+            except Exception as e:
+                print(f"Ошибка при прогреве кэша для города {city}: {e}")
+            await asyncio.sleep(max(step - (time.monotonic() - started), 0))
+
+def format_weather(city: str, current, forecast, age=None) -> str:
+    """Формирует сообщение о текущей погоде и прогнозе на ближайшие 3 часа (age - возраст устаревших данных, с)."""
+    temperature = current.temp
+    feels_like = current.feels_like
+    description = current.description
+    pressure_hpa = current.pressure
+    pressure_atm = hpa_to_atm(pressure_hpa)  # Пересчитываем давление
+    humidity = current.humidity
+    wind_speed = current.wind_speed
+    visibility = current.visibility if current.visibility is not None else "Нет данных" #видимость может отсутствовать
+
+    # Печатаем прогноз на ближайшие 3 часа
+    next_slot = forecast.slots[0] #Самый ближайший прогноз
+    forecast_temperature = next_slot.temp
+    forecast_description = next_slot.description
+    forecast_time_utc = next_slot.dt #Время в UTC (Unix-время)
+
+    # Переводим время прогноза в местный часовой пояс города
+    timezone = city_timezone(city, current.timezone)
+    forecast_time_local = format_local_time(forecast_time_utc, timezone)
+
+    weather_info = (
+        f"Погода в городе {city}:\n"
+        f"Температура: {temperature}°C\n"
+        f"Ощущается как: {feels_like}°C\n"
+        f"Описание: {description}\n"
+        f"Влажность: {humidity}%\n"
+        f"Давление: {pressure_hpa} гПа ({pressure_atm:.2f} атм)\n"
+        f"Скорость ветра: {wind_speed} м/с\n"
+        f"Видимость: {visibility} м\n"
+        f"\nПрогноз на {forecast_time_local} (Местное время):\n"
+        f"Температура: {forecast_temperature}°C\n"
+        f"Описание: {forecast_description}"
     )
+    if age is not None:
+        weather_info += f"\n\n⚠️ Сервис погоды недоступен, данные получены {format_age(age)} назад."
+    return weather_info
 
 async def get_weather(city: str, message: types.Message) -> None:
     """Получает погоду и прогноз для указанного города."""
     try:
-        # 1. Текущая погода
-        current_url = f"http://api.openweathermap.org/data/2.5/weather?q={city}&appid={OPENWEATHERMAP_API_KEY}&units=metric&lang=ru"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(current_url) as current_response:
-                current_response.raise_for_status() # Проверяем на ошибки
-                current_data = await current_response.json()
-
-        if current_data["cod"] != 200:
-            await message.reply("Город не найден, попробуйте еще раз.")
-            return
-
-        temperature = current_data["main"]["temp"]
-        feels_like = current_data["main"]["feels_like"]
-        description = current_data["weather"][0]["description"]
-        pressure_hpa = current_data["main"]["pressure"]
-        pressure_atm = hpa_to_atm(pressure_hpa)  # Пересчитываем давление
-        humidity = current_data["main"]["humidity"]
-        wind_speed = current_data["wind"]["speed"]
-        visibility = current_data.get("visibility", "Нет данных") #видимость может отсутствовать
-
-        # 2. Прогноз погоды
-        # Получаем координаты города
-        geo_url = f"http://api.openweathermap.org/geo/1.0/direct?q={city}&limit=1&appid={OPENWEATHERMAP_API_KEY}"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(geo_url) as geo_response:
-                geo_response.raise_for_status()
-                geo_data = await geo_response.json()
-
-        lat = geo_data[0]["lat"]
-        lon = geo_data[0]["lon"]
-
-        # Формируем URL для запроса прогноза погоды
-        forecast_url = f"http://api.openweathermap.org/data/2.5/forecast?lat={lat}&lon={lon}&appid={OPENWEATHERMAP_API_KEY}&units=metric&lang=ru"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(forecast_url) as forecast_response:
-                forecast_response.raise_for_status()
-                forecast_data = await forecast_response.json()
-
-        # Печатаем прогноз на ближайшие 3 часа
-        forecast = forecast_data['list'][0] #Самый ближайший прогноз
-        forecast_temperature = forecast['main']['temp']
-        forecast_description = forecast['weather'][0]['description']
-        forecast_time_utc = forecast['dt_txt'] #Время в UTC
-
-        # Определяем часовой пояс города (пример, нужно уточнять для каждого города!)
-        if city == "Москва" or city == "Санкт-Петербург" or city == "Казань" or city == "Нижний Новгород" or city == "Ростов-на-Дону":
-            timezone = pytz.timezone('Europe/Moscow')
-        elif city == "Новосибирск":
-            timezone = pytz.timezone('Asia/Novosibirsk')
-        elif city == "Екатеринбург" or city == "Челябинск":
-            timezone = pytz.timezone('Asia/Yekaterinburg')
-        elif city == "Омск":
-            timezone = pytz.timezone('Asia/Omsk')
-        elif city == "Самара":
-            timezone = pytz.timezone('Europe/Samara')
-        else:
-            timezone = pytz.utc #Если город не известен, используем UTC
-
-        # Преобразуем время в местный часовой пояс
-        forecast_time_utc_dt = datetime.strptime(forecast_time_utc, '%Y-%m-%d %H:%M:%S') #Преобразуем строку во время
-        forecast_time_local_dt = pytz.utc.localize(forecast_time_utc_dt).astimezone(timezone) #Локализиурем и переводим во временную зону
-        forecast_time_local = forecast_time_local_dt.strftime('%Y-%m-%d %H:%M:%S') #Форматируем в строку
-
-        # 3. Формируем и отправляем сообщение
-        weather_info = (
-            f"Погода в городе {city}:\n"
-            f"Температура: {temperature}°C\n"
-            f"Ощущается как: {feels_like}°C\n"
-            f"Описание: {description}\n"
-            f"Влажность: {humidity}%\n"
-            f"Давление: {pressure_hpa} гПа ({pressure_atm:.2f} атм)\n"
-            f"Скорость ветра: {wind_speed} м/с\n"
-            f"Видимость: {visibility} м\n"
-            f"\nПрогноз на {forecast_time_local} (Местное время):\n"
-            f"Температура: {forecast_temperature}°C\n"
-            f"Описание: {forecast_description}"
-        )
-        await message.reply(weather_info)
+        # Текущая погода и прогноз (запросы идут параллельно)
+        current, forecast, age = await fetch_weather_data(city)
+        hot_cities.record(city)
+        await message.reply(format_weather(city, current, forecast, age))
 
+    except CityNotFound:
+        await message.reply("Город не найден, попробуйте еще раз.")
+    except CircuitOpen:
+        await message.reply("Сервис погоды временно недоступен. Попробуйте через минуту.")
+    except RateLimited as e:
+        print(f"Ограничение запросов к API: {e}")
+        await message.reply("Слишком много запросов к сервису погоды. Попробуйте через минуту.")
     except aiohttp.ClientError as e:
         print(f"Ошибка при запросе к API: {e}")
         await message.reply("Произошла ошибка при получении погоды. Попробуйте позже.")
@@ -167,16 +430,271 @@ async def get_weather(city: str, message: types.Message) -> None:
         print(f"Непредвиденная ошибка: {e}")
         await message.reply("Произошла непредвиденная ошибка. Пожалуйста, попробуйте позже.")
 
+def create_forecast_pager(city: str, day_index: int, days_count: int):
+    """Создает кнопки листания прогноза по дням."""
+    builder = InlineKeyboardBuilder()
+    if day_index > 0 and pager_callback(day_index - 1, city):
+        builder.add(types.InlineKeyboardButton(text="◀ Назад", callback_data=pager_callback(day_index - 1, city)))
+    if day_index < days_count - 1 and pager_callback(day_index + 1, city):
+        builder.add(types.InlineKeyboardButton(text="Вперед ▶", callback_data=pager_callback(day_index + 1, city)))
+    return builder.as_markup()
+
+async def render_forecast_day(city: str, day_index: int):
+    """Возвращает текст и клавиатуру прогноза на выбранный день (из кэшированного прогноза)."""
+    forecast = await get_forecast(city)
+    timezone = city_timezone(city, forecast.timezone)
+    days = daily_summaries(forecast, timezone)
+    day_index = max(0, min(day_index, len(days) - 1))
+    text = format_forecast_day(city, forecast, days, day_index, timezone)
+    return text, create_forecast_pager(city, day_index, len(days))
+
+def forecast_error_text(error: Exception) -> str:
+    """Возвращает текст ответа пользователю для ошибки при получении прогноза."""
+    if isinstance(error, CityNotFound):
+        return "Город не найден, попробуйте еще раз."
+    if isinstance(error, CircuitOpen):
+        return "Сервис погоды временно недоступен. Попробуйте через минуту."
+    if isinstance(error, RateLimited):
+        return "Слишком много запросов к сервису погоды. Попробуйте через минуту."
+    print(f"Ошибка при получении прогноза: {error}")
+    return "Произошла ошибка при получении прогноза. Попробуйте позже."
+
+# Обработчик команды /forecast
+@dp.message(Command("forecast"))
+async def command_forecast_handler(message: types.Message, command: CommandObject) -> None:
+    """Отправляет прогноз по дням с кнопками листания."""
+    city = (command.args or "").strip()
+    if not city:
+        await message.answer("Укажите город, например: /forecast Москва")
+        return
+    city = gazetteer.canonical(city)
+    try:
+        text, markup = await render_forecast_day(city, 0)
+    except (CityNotFound, RateLimited, aiohttp.ClientError, KeyError, IndexError) as e:
+        await message.reply(forecast_error_text(e))
+        return
+    await message.answer(text, reply_markup=markup)
+
+# Листание прогноза по дням
+@dp.callback_query(F.data.startswith(CALLBACK_PREFIX))
+async def callback_forecast_page(call: types.CallbackQuery) -> None:
+    """Показывает прогноз на другой день, редактируя сообщение."""
+    day_index, city = parse_pager_callback(call.data)
+    try:
+        text, markup = await render_forecast_day(city, day_index)
+    except (CityNotFound, RateLimited, aiohttp.ClientError, KeyError, IndexError) as e:
+        await call.answer(forecast_error_text(e))
+        return
+    try:
+        await call.message.edit_text(text, reply_markup=markup)
+    except TelegramBadRequest:
+        pass  # Сообщение не изменилось (повторное нажатие)
+    await call.answer()
+
+# Обработчик команды /subscribe
+@dp.message(Command("subscribe"))
+async def command_subscribe_handler(message: types.Message, command: CommandObject) -> None:
+    """Подписывает чат на ежедневный прогноз для города."""
+    parsed = parse_subscribe_args(command.args)
+    if parsed is None:
+        await message.answer("Укажите город и время, например: /subscribe Москва 07:30")
+        return
+    city, local_time = parsed
+    city = gazetteer.canonical(city)
+    try:
+        forecast = await get_forecast(city)  # Заодно проверяем, что город существует
+    except (CityNotFound, RateLimited, aiohttp.ClientError, KeyError, IndexError) as e:
+        await message.reply(forecast_error_text(e))
+        return
+    subscription_store.add(message.chat.id, city, local_time, city_timezone(city, forecast.timezone))
+    await message.answer(f"Готово! Каждый день в {local_time} (местное время) я буду присылать прогноз для города {city}.")
+
+# Обработчик команды /unsubscribe
+@dp.message(Command("unsubscribe"))
+async def command_unsubscribe_handler(message: types.Message, command: CommandObject) -> None:
+    """Отменяет подписку на город (или все подписки чата)."""
+    city = (command.args or "").strip() or None
+    if city:
+        city = gazetteer.canonical(city)  # Подписка сохранена под каноническим названием (см. /subscribe)
+    removed = subscription_store.remove(message.chat.id, city)
+    if removed:
+        await message.answer("Подписка отменена." if city else f"Отменено подписок: {removed}.")
+    else:
+        await message.answer("Подписок не найдено.")
+
+async def deliver_subscriptions(utc_minute: int):
+    """Ставит в очередь рассылки прогнозы для подписок, наступивших в эту минуту.
+
+    Подписки сгруппированы по городу: прогноз каждого города запрашивается один раз.
+    """
+    due = subscription_store.due(utc_minute)
+    if not due:
+        return
+    results = await asyncio.gather(*(render_forecast_day(city, 0) for city in due), return_exceptions=True)
+    for (city, chat_ids), result in zip(due.items(), results):
+        if isinstance(result, Exception):
+            print(f"Ошибка при подготовке рассылки для города {city}: {result}")
+            continue
+        text, markup = result
+        for chat_id in chat_ids:
+            send_queue.put_nowait((chat_id, text, markup))
+
+async def subscriptions_loop():
+    """Фоновая задача: раз в минуту рассылает прогнозы подписчикам."""
+    last_minute = None
+    while True:
+        await asyncio.sleep(60 - time.time() % 60)
+        minute = int(time.time() // 60)
+        # Если цикл событий был занят, догоняем пропущенные минуты (но не больше пяти)
+        first = minute if last_minute is None else max(last_minute + 1, minute - 4)
+        try:
+            subscription_store.reschedule()  # Переход на летнее/зимнее время меняет минуту отправки по UTC
+        except Exception as e:
+            print(f"Ошибка при пересчете времени подписок: {e}")
+        for pending_minute in range(first, minute + 1):
+            try:
+                await deliver_subscriptions(pending_minute % MINUTES_PER_DAY)
+            except Exception as e:
+                print(f"Ошибка при рассылке подписок: {e}")
+        last_minute = minute
+
+async def send_worker():
+    """Фоновая задача: отправляет сообщения из очереди рассылки с учетом лимита Telegram."""
+    while True:
+        chat_id, text, markup = await send_queue.get()
+        try:
+            await send_limiter.acquire_async()
+            await bot.send_message(chat_id, text, reply_markup=markup)
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+            send_queue.put_nowait((chat_id, text, markup))
+        except TelegramForbiddenError:
+            subscription_store.remove(chat_id)  # Пользователь заблокировал бота
+        except Exception as e:
+            print(f"Ошибка при отправке рассылки в чат {chat_id}: {e}")
+        finally:
+            send_queue.task_done()
+
+# Обработчик команды /stats
+@dp.message(Command("stats"))
+async def command_stats_handler(message: types.Message) -> None:
+    """Показывает расход квоты OpenWeatherMap и эффективность кэша (только чатам из STATS_CHAT_IDS)."""
+    if message.chat.id not in STATS_CHAT_IDS:
+        return  # Служебная статистика не для пользователей бота
+    quota = rate_limiter.stats()
+    current_stats = current_cache.stats()
+    forecast_stats = forecast_cache.stats()
+    circuit = circuit_breaker.stats()
+    text = (
+        f"Запросов к OpenWeatherMap сегодня: {quota['calls_today']}"
+        f"{' из ' + str(quota['daily_quota']) if quota['daily_quota'] else ''}\n"
+        f"Отклонено из-за лимита: {quota['throttled']}\n"
+        f"Кэш текущей погоды: {current_stats['hits']} попаданий, {current_stats['misses']} промахов\n"
+        f"Кэш прогнозов: {forecast_stats['hits']} попаданий, {forecast_stats['misses']} промахов\n"
+        f"Предохранитель: {'разомкнут' if circuit['open'] else 'замкнут'}, срабатываний: {circuit['trips']}"
+    )
+    await message.answer(text)
+
+async def inline_weather_card(city: str):
+    """Возвращает карточку погоды для inline-режима (из кэша карточек)."""
+    async def render():
+        current, forecast, age = await fetch_weather_data(city)
+        return format_weather(city, current, forecast, age), f"{current.temp:.0f}°C, {current.description}"
+    return await inline_cache.get_or_fetch_async(normalize_city(city), render)
+
+# Inline-запросы: @бот <город>
+@dp.inline_query()
+async def inline_query_handler(query: types.InlineQuery) -> None:
+    """Отвечает карточками погоды для городов, подходящих под введенный текст."""
+    # Запросы приходят на каждое нажатие клавиши: отвечаем только на последний после паузы
+    user_id = query.from_user.id
+    inline_latest[user_id] = query.id
+    await asyncio.sleep(INLINE_DEBOUNCE)
+    if inline_latest.get(user_id) != query.id:
+        return
+    del inline_latest[user_id]
+
+    text = query.query.strip()
+    if not text:
+        cities = [city for row in KEYBOARD_CITIES for city in row][:INLINE_RESULTS]
+    elif looks_like_city(text):
+        found = gazetteer.complete(text, INLINE_RESULTS) or gazetteer.suggest(text, INLINE_RESULTS)
+        cities = [city.name for city in found]
+    else:
+        cities = []
+
+    cards = await asyncio.gather(*(inline_weather_card(city) for city in cities), return_exceptions=True)
+    results = []
+    for city, card in zip(cities, cards):
+        if isinstance(card, Exception):
+            print(f"Ошибка при подготовке inline-карточки для города {city}: {card}")
+            continue
+        message_text, description = card
+        results.append(types.InlineQueryResultArticle(
+            id=str(len(results)),
+            title=city,
+            description=description,
+            input_message_content=types.InputTextMessageContent(message_text=message_text),
+        ))
+    try:
+        await query.answer(results, cache_time=INLINE_CACHE_TIME)
+    except TelegramBadRequest as e:
+        print(f"Не удалось ответить на inline-запрос: {e}")  # Например, запрос уже устарел
+
+def create_suggestions_keyboard(text: str, suggestions: list):
+    """Создает кнопки с вариантами исправления названия города."""
+    builder = InlineKeyboardBuilder()
+    for city in suggestions:
+        builder.row(types.InlineKeyboardButton(text=city.name, callback_data=city_callback(city.name)))
+    if city_callback(text):
+        builder.row(types.InlineKeyboardButton(text=f"Искать «{text}»", callback_data=city_callback(text)))
+    return builder.as_markup()
+
+# Выбор города из подсказок
+@dp.callback_query(F.data.startswith(CITY_CALLBACK_PREFIX))
+async def callback_city_suggestion(call: types.CallbackQuery) -> None:
+    """Показывает погоду для города, выбранного из подсказок."""
+    await call.answer()
+    await get_weather(call.data[len(CITY_CALLBACK_PREFIX):], call.message)
+
 # Обработчик текстовых сообщений
 @dp.message(F.text)
 async def handle_message(message: types.Message):
-     await get_weather(message.text, message)
+    text = message.text.strip()
+    # Явно некорректный ввод не отправляем в API
+    if not looks_like_city(text):
+        await message.reply("Это не похоже на название города. Напишите город, например: Москва")
+        return
+    known = gazetteer.get(text)
+    if known is not None:
+        await get_weather(known.name, message)
+        return
+    # Возможная опечатка: предлагаем похожие города из справочника
+    suggestions = gazetteer.suggest(text)
+    if suggestions:
+        await message.reply("Возможно, вы имели в виду:", reply_markup=create_suggestions_keyboard(text, suggestions))
+        return
+    await get_weather(text, message)
 
 # Функция запуска бота
 async def main():
+    global http_session, send_queue
+    http_session = create_http_session()
+    send_queue = asyncio.Queue()
+    background_tasks = [
+        asyncio.create_task(prewarm_loop()),
+        asyncio.create_task(subscriptions_loop()),
+        asyncio.create_task(send_worker()),
+    ]
     try:
         await dp.start_polling(bot)
     finally:
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        await http_session.close()
+        geocode_store.close()
+        subscription_store.close()
         await bot.session.close()
 
 if __name__ == '__main__':
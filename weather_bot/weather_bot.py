@@ -1,9 +1,27 @@
 import telebot
 import requests
 import os
+import queue
+import threading
+import time
 from dotenv import load_dotenv
-import pytz
-from datetime import datetime
+from requests.adapters import HTTPAdapter
+
+from weather_time import city_timezone, format_age, format_local_time, register_city_timezone
+from weather_parse import parse_current, parse_forecast, split_forecast
+from weather_forecast import CALLBACK_PREFIX, daily_summaries, format_forecast_day, pager_callback, parse_pager_callback
+from weather_limits import (
+    RateLimiter, RateLimited, CircuitBreaker, CircuitOpen,
+    CALLS_PER_MINUTE, MAX_QUEUE_WAIT, DAILY_QUOTA, FAILURE_THRESHOLD, SLOW_CALL_THRESHOLD, RESET_TIMEOUT,
+)
+from weather_subscriptions import (
+    SubscriptionStore, parse_subscribe_args, MINUTES_PER_DAY, SUBSCRIPTIONS_DB_PATH, TELEGRAM_MESSAGES_PER_SECOND,
+)
+from weather_gazetteer import Gazetteer, city_callback, looks_like_city, CITY_CALLBACK_PREFIX, GAZETTEER_PATH
+from weather_cache import (
+    TTLCache, GeocodeStore, CityNotFound, normalize_city, place_from_geo,
+    CURRENT_WEATHER_TTL, FORECAST_TTL, CACHE_MAX_SIZE, GEOCODE_DB_PATH, GEOCODE_NEGATIVE_TTL,
+)
 
 # Загружаем переменные окружения из .env файла
 load_dotenv()
@@ -16,7 +34,77 @@ if not BOT_TOKEN or not OPENWEATHERMAP_API_KEY:
     print("Ошибка: Необходимы переменные окружения TELEGRAM_BOT_TOKEN и OPENWEATHERMAP_API_KEY.")
     exit()
 
-bot = telebot.TeleBot(BOT_TOKEN)
+OWM_BASE_URL = "http://api.openweathermap.org"
+
+# Настройки обработки сообщений и HTTP-клиента (можно переопределить через .env)
+BOT_WORKERS = int(os.environ.get("BOT_WORKERS", 8))  # Сколько сообщений обрабатывается одновременно
+OWM_CONNECT_TIMEOUT = float(os.environ.get("OWM_CONNECT_TIMEOUT", 3))  # Таймаут на установку соединения, с
+OWM_READ_TIMEOUT = float(os.environ.get("OWM_READ_TIMEOUT", 5))  # Таймаут на чтение ответа, с
+OWM_RETRIES = int(os.environ.get("OWM_RETRIES", 2))  # Повторы при сетевых ошибках и 5xx
+OWM_RETRY_BACKOFF = float(os.environ.get("OWM_RETRY_BACKOFF", 0.3))  # Базовая пауза между повторами, с
+OWM_RETRY_STATUSES = (500, 502, 503, 504)  # Ответы, после которых запрос повторяется
+
+# Настройки кэша ответов OpenWeatherMap
+OWM_CURRENT_TTL = float(os.environ.get("OWM_CURRENT_TTL", CURRENT_WEATHER_TTL))
+OWM_FORECAST_TTL = float(os.environ.get("OWM_FORECAST_TTL", FORECAST_TTL))
+OWM_CACHE_SIZE = int(os.environ.get("OWM_CACHE_SIZE", CACHE_MAX_SIZE))
+OWM_GEOCODE_DB = os.environ.get("OWM_GEOCODE_DB", GEOCODE_DB_PATH)
+OWM_GEOCODE_NEGATIVE_TTL = float(os.environ.get("OWM_GEOCODE_NEGATIVE_TTL", GEOCODE_NEGATIVE_TTL))
+GAZETTEER_FILE = os.environ.get("GAZETTEER_FILE", GAZETTEER_PATH)  # Локальный справочник городов
+
+# Ограничение частоты запросов к OpenWeatherMap
+OWM_CALLS_PER_MINUTE = float(os.environ.get("OWM_CALLS_PER_MINUTE", CALLS_PER_MINUTE))
+OWM_MAX_QUEUE_WAIT = float(os.environ.get("OWM_MAX_QUEUE_WAIT", MAX_QUEUE_WAIT))
+OWM_DAILY_QUOTA = int(os.environ.get("OWM_DAILY_QUOTA", DAILY_QUOTA))
+
+# Предохранитель: при недоступности OpenWeatherMap бот сразу отвечает последними известными данными
+OWM_FAILURE_THRESHOLD = int(os.environ.get("OWM_FAILURE_THRESHOLD", FAILURE_THRESHOLD))
+OWM_SLOW_CALL_THRESHOLD = float(os.environ.get("OWM_SLOW_CALL_THRESHOLD", SLOW_CALL_THRESHOLD))
+OWM_RESET_TIMEOUT = float(os.environ.get("OWM_RESET_TIMEOUT", RESET_TIMEOUT))
+
+# Стратегия запросов: "full" - текущая погода, геокодинг и прогноз (3 запроса);
+# "forecast" - для городов с известными координатами все берется из одного ответа /forecast
+OWM_FETCH_STRATEGY = os.environ.get("OWM_FETCH_STRATEGY", "full")
+
+# Подписки на ежедневный прогноз
+SUBSCRIPTIONS_DB = os.environ.get("SUBSCRIPTIONS_DB", SUBSCRIPTIONS_DB_PATH)
+SEND_MESSAGES_PER_SECOND = float(os.environ.get("SEND_MESSAGES_PER_SECOND", TELEGRAM_MESSAGES_PER_SECOND))
+
+# Чаты, которым доступна служебная команда /stats (id через запятую); по умолчанию - никому
+STATS_CHAT_IDS = {int(chat_id) for chat_id in os.environ.get("STATS_CHAT_IDS", "").split(",") if chat_id.strip()}
+
+# Обработчики сообщений выполняются в пуле потоков, чтобы медленный ответ API не блокировал остальных
+bot = telebot.TeleBot(BOT_TOKEN, threaded=True, num_threads=BOT_WORKERS)
+
+def create_http_session():
+    """Создает общую HTTP-сессию с пулом соединений (повторы запросов - в fetch_owm)."""
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=BOT_WORKERS)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# Общая HTTP-сессия для всех запросов к OpenWeatherMap
+http_session = create_http_session()
+
+# Кэши текущей погоды и прогноза (ключ - нормализованное название города)
+current_cache = TTLCache(ttl=OWM_CURRENT_TTL, maxsize=OWM_CACHE_SIZE)
+forecast_cache = TTLCache(ttl=OWM_FORECAST_TTL, maxsize=OWM_CACHE_SIZE)
+# Справочник городов: исправление опечаток и координаты без запросов к геокодеру
+gazetteer = Gazetteer.load(GAZETTEER_FILE)
+for known_city in gazetteer.cities:
+    register_city_timezone(known_city.name, known_city.timezone)
+# Постоянный кэш координат: повторные запросы города не обращаются к геокодеру
+geocode_store = GeocodeStore(OWM_GEOCODE_DB, negative_ttl=OWM_GEOCODE_NEGATIVE_TTL)
+# Общий для всех запросов к OpenWeatherMap ограничитель частоты и счетчик суточной квоты
+rate_limiter = RateLimiter(OWM_CALLS_PER_MINUTE, max_wait=OWM_MAX_QUEUE_WAIT, daily_quota=OWM_DAILY_QUOTA)
+circuit_breaker = CircuitBreaker(OWM_FAILURE_THRESHOLD, OWM_SLOW_CALL_THRESHOLD, OWM_RESET_TIMEOUT)
+revalidations = set()  # Города, кэш которых сейчас обновляется в фоне
+revalidations_lock = threading.Lock()
+# Подписки и очередь рассылки (ограничена общим лимитом Telegram на отправку сообщений)
+subscription_store = SubscriptionStore(SUBSCRIPTIONS_DB)
+send_limiter = RateLimiter(SEND_MESSAGES_PER_SECOND * 60, max_wait=60, burst=SEND_MESSAGES_PER_SECOND)
+send_queue = queue.Queue()
 
 def hpa_to_atm(hpa):
     """Переводит давление из гектопаскалей в атмосферы."""
@@ -44,71 +132,191 @@ def create_keyboard():
 def send_welcome(message):
     """Отправляет приветственное сообщение и показывает меню."""
     markup = create_keyboard()
-    bot.reply_to(message, "Привет! Я бот погоды. Выберите город или отправьте мне название города.",
+    bot.reply_to(message, "Привет! Я бот погоды. Выберите город или отправьте мне название города.\n"
+                          "Прогноз на 5 дней по дням: /forecast <город>\n"
+                          "Ежедневный прогноз: /subscribe <город> <ЧЧ:ММ>, отмена: /unsubscribe [город]",
                  reply_markup=markup)
 
 
+def fetch_owm(path, **params):
+    """Выполняет GET-запрос к OpenWeatherMap и возвращает JSON.
+
+    При сетевых ошибках и ответах 5xx запрос повторяется до OWM_RETRIES раз. Каждая попытка
+    берет токен у ограничителя частоты и учитывается предохранителем: повторы тоже расходуют квоту.
+    """
+    params["appid"] = OPENWEATHERMAP_API_KEY
+    for attempt in range(OWM_RETRIES + 1):
+        if attempt:
+            time.sleep(OWM_RETRY_BACKOFF * 2 ** (attempt - 1))
+        circuit_breaker.before_call()
+        rate_limiter.acquire()
+        started = time.monotonic()
+        try:
+            response = http_session.get(f"{OWM_BASE_URL}{path}", params=params, timeout=(OWM_CONNECT_TIMEOUT, OWM_READ_TIMEOUT))
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            circuit_breaker.record_failure()
+            if attempt < OWM_RETRIES:
+                continue
+            raise
+        except requests.exceptions.RequestException:
+            circuit_breaker.record_failure()
+            raise
+        if response.status_code >= 500:
+            circuit_breaker.record_failure()
+            if response.status_code in OWM_RETRY_STATUSES and attempt < OWM_RETRIES:
+                continue
+        else:
+            # Ответы 4xx (например, 404 для неизвестного города) - не признак недоступности сервиса
+            circuit_breaker.record_success(time.monotonic() - started)
+        break
+    if response.status_code == 429:
+        raise RateLimited("OpenWeatherMap вернул 429 Too Many Requests")
+    response.raise_for_status() # Проверяем на ошибки
+    return response.json()
+
+def resolve_city(city):
+    """Возвращает координаты города из справочника, постоянного кэша или запрашивает их у геокодера."""
+    known = gazetteer.get(city)
+    if known is not None:
+        return known.place
+    key = normalize_city(city)
+    place = geocode_store.get(key)
+    if place is None:
+        geo_data = fetch_owm("/geo/1.0/direct", q=city, limit=1)
+        try:
+            place = place_from_geo(geo_data)
+        except CityNotFound:
+            geocode_store.put_not_found(key)
+            raise
+        geocode_store.put(key, place)
+    return place
+
+def fetch_current(city):
+    """Запрашивает текущую погоду (404 от API запоминается как ненайденный город)."""
+    known = gazetteer.get(city)
+    location = {"lat": known.lat, "lon": known.lon} if known is not None else {"q": city}
+    try:
+        current_data = fetch_owm("/data/2.5/weather", units="metric", lang="ru", **location)
+    except requests.exceptions.HTTPError as e:
+        if e.response.status_code == 404:
+            geocode_store.put_not_found(normalize_city(city))
+            raise CityNotFound(city) from e
+        raise
+    return parse_current(current_data)
+
+def fetch_forecast(city):
+    """Получает координаты города и запрашивает прогноз по ним."""
+    place = resolve_city(city)
+    forecast_data = fetch_owm("/data/2.5/forecast", lat=place.lat, lon=place.lon, units="metric", lang="ru")
+    return parse_forecast(forecast_data)
+
+def get_forecast(city):
+    """Возвращает прогноз города из кэша (при исчерпании лимита - устаревший)."""
+    key = normalize_city(city)
+    geocode_store.get(key)  # Город, который недавно не нашелся, сразу отсекаем без запросов к API
+    try:
+        return forecast_cache.get_or_fetch(key, lambda: fetch_forecast(city))
+    except RateLimited:
+        forecast = forecast_cache.get_stale(key)
+        if forecast is None:
+            raise
+        return forecast
+
+def stale_weather_data(key):
+    """Возвращает последние известные данные города: (текущая погода, прогноз, возраст в секундах) или None."""
+    current, forecast = current_cache.get_stale(key), forecast_cache.get_stale(key)
+    if forecast is None:
+        return None
+    if current is None:
+        # Текущей погоды в кэше нет (стратегия "forecast"): берем ближайший слот прогноза
+        current, forecast = split_forecast(forecast)
+        return current, forecast, forecast_cache.age(key)
+    return current, forecast, current_cache.age(key)
+
+def revalidate_city(key, city):
+    """Обновляет кэш города (выполняется в фоновом потоке)."""
+    try:
+        if OWM_FETCH_STRATEGY != "forecast":
+            current_cache.set(key, fetch_current(city))
+        forecast_cache.set(key, fetch_forecast(city))
+    except CircuitOpen:
+        pass  # Сервис все еще недоступен, пробный запрос уже выполняется в другом месте
+    except Exception as e:
+        print(f"Ошибка при фоновом обновлении кэша для города {city}: {e}")
+    finally:
+        with revalidations_lock:
+            revalidations.discard(key)
+
+def revalidate_in_background(key, city):
+    """Запускает фоновое обновление кэша города (одно на город), не заставляя пользователя ждать."""
+    with revalidations_lock:
+        if key in revalidations:
+            return
+        revalidations.add(key)
+    threading.Thread(target=revalidate_city, args=(key, city), daemon=True).start()
+
+def fetch_weather_data(city):
+    """Возвращает текущую погоду и прогноз для города, используя кэш.
+
+    Возвращает (текущая погода, прогноз, возраст данных): возраст в секундах, если сервис
+    недоступен и отданы устаревшие данные из кэша, иначе None.
+    """
+    key = normalize_city(city)
+    known = gazetteer.get(city)
+    # Город, который недавно не нашелся, сразу отсекаем без запросов к API
+    place = known.place if known is not None else geocode_store.get(key)
+    if circuit_breaker.is_open:
+        # Сервис недоступен: сразу отвечаем последними известными данными, а кэш обновляем в фоне
+        stale = stale_weather_data(key)
+        if stale is not None:
+            revalidate_in_background(key, city)
+            return stale
+
+    try:
+        if OWM_FETCH_STRATEGY == "forecast" and place is not None:
+            # Координаты известны: текущая погода и прогноз берутся из одного ответа /forecast
+            current, forecast = split_forecast(forecast_cache.get_or_fetch(key, lambda: fetch_forecast(city)))
+        else:
+            current = current_cache.get_or_fetch(key, lambda: fetch_current(city))
+            forecast = forecast_cache.get_or_fetch(key, lambda: fetch_forecast(city))
+    except (RateLimited, requests.exceptions.RequestException) as e:
+        # Лимит запросов исчерпан или сервис недоступен: отдаем устаревшие данные из кэша, если они есть
+        response = getattr(e, "response", None)
+        if response is not None and response.status_code < 500:
+            raise
+        stale = stale_weather_data(key)
+        if stale is None:
+            raise
+        return stale
+    if current.timezone is not None:
+        geocode_store.set_timezone(key, current.timezone)
+    return current, forecast, None
+
 def get_weather(message, city):
     """Получает погоду и прогноз для указанного города."""
     try:
-        # 1. Текущая погода
-        current_url = f"http://api.openweathermap.org/data/2.5/weather?q={city}&appid={OPENWEATHERMAP_API_KEY}&units=metric&lang=ru"
-        current_response = requests.get(current_url)
-        current_response.raise_for_status() # Проверяем на ошибки
-        current_data = current_response.json()
-
-        if current_data["cod"] != 200:
-            bot.reply_to(message, "Город не найден, попробуйте еще раз.")
-            return
+        # 1. Текущая погода и прогноз
+        current, forecast, age = fetch_weather_data(city)
 
-        temperature = current_data["main"]["temp"]
-        feels_like = current_data["main"]["feels_like"]
-        description = current_data["weather"][0]["description"]
-        pressure_hpa = current_data["main"]["pressure"]
+        temperature = current.temp
+        feels_like = current.feels_like
+        description = current.description
+        pressure_hpa = current.pressure
         pressure_atm = hpa_to_atm(pressure_hpa)  # Пересчитываем давление
-        humidity = current_data["main"]["humidity"]
-        wind_speed = current_data["wind"]["speed"]
-        visibility = current_data.get("visibility", "Нет данных") #видимость может отсутствовать
+        humidity = current.humidity
+        wind_speed = current.wind_speed
+        visibility = current.visibility if current.visibility is not None else "Нет данных" #видимость может отсутствовать
 
         # 2. Прогноз погоды
-        # Получаем координаты города
-        geo_url = f"http://api.openweathermap.org/geo/1.0/direct?q={city}&limit=1&appid={OPENWEATHERMAP_API_KEY}"
-        geo_response = requests.get(geo_url)
-        geo_response.raise_for_status()
-        geo_data = geo_response.json()
-        lat = geo_data[0]["lat"]
-        lon = geo_data[0]["lon"]
-
-        # Формируем URL для запроса прогноза погоды
-        forecast_url = f"http://api.openweathermap.org/data/2.5/forecast?lat={lat}&lon={lon}&appid={OPENWEATHERMAP_API_KEY}&units=metric&lang=ru"
-        forecast_response = requests.get(forecast_url)
-        forecast_response.raise_for_status()
-        forecast_data = forecast_response.json()
-
         # Печатаем прогноз на ближайшие 3 часа
-        forecast = forecast_data['list'][0] #Самый ближайший прогноз
-        forecast_temperature = forecast['main']['temp']
-        forecast_description = forecast['weather'][0]['description']
-        forecast_time_utc = forecast['dt_txt'] #Время в UTC
-
-        # Определяем часовой пояс города (пример, нужно уточнять для каждого города!)
-        if city == "Москва" or city == "Санкт-Петербург" or city == "Казань" or city == "Нижний Новгород" or city == "Ростов-на-Дону":
-            timezone = pytz.timezone('Europe/Moscow')
-        elif city == "Новосибирск":
-            timezone = pytz.timezone('Asia/Novosibirsk')
-        elif city == "Екатеринбург" or city == "Челябинск":
-            timezone = pytz.timezone('Asia/Yekaterinburg')
-        elif city == "Омск":
-            timezone = pytz.timezone('Asia/Omsk')
-        elif city == "Самара":
-            timezone = pytz.timezone('Europe/Samara')
-        else:
-            timezone = pytz.utc #Если город не известен, используем UTC
+        next_slot = forecast.slots[0] #Самый ближайший прогноз
+        forecast_temperature = next_slot.temp
+        forecast_description = next_slot.description
+        forecast_time_utc = next_slot.dt #Время в UTC (Unix-время)
 
-        # Преобразуем время в местный часовой пояс
-        forecast_time_utc_dt = datetime.strptime(forecast_time_utc, '%Y-%m-%d %H:%M:%S') #Преобразуем строку во время
-        forecast_time_local_dt = pytz.utc.localize(forecast_time_utc_dt).astimezone(timezone) #Локализиурем и переводим во временную зону
-        forecast_time_local = forecast_time_local_dt.strftime('%Y-%m-%d %H:%M:%S') #Форматируем в строку
+        # Переводим время прогноза в местный часовой пояс города
+        timezone = city_timezone(city, current.timezone)
+        forecast_time_local = format_local_time(forecast_time_utc, timezone)
 
         # 3. Формируем и отправляем сообщение
         weather_info = (
@@ -124,8 +332,17 @@ def get_weather(message, city):
             f"Температура: {forecast_temperature}°C\n"
             f"Описание: {forecast_description}"
         )
+        if age is not None:
+            weather_info += f"\n\n⚠️ Сервис погоды недоступен, данные получены {format_age(age)} назад."
         bot.send_message(message.chat.id, weather_info, parse_mode="Markdown") #Добавили Markdown для жирного шрифта
 
+    except CityNotFound:
+        bot.reply_to(message, "Город не найден, попробуйте еще раз.")
+    except CircuitOpen:
+        bot.reply_to(message, "Сервис погоды временно недоступен. Попробуйте через минуту.")
+    except RateLimited as e:
+        print(f"Ограничение запросов к API: {e}")
+        bot.reply_to(message, "Слишком много запросов к сервису погоды. Попробуйте через минуту.")
     except requests.exceptions.RequestException as e:
         print(f"Ошибка при запросе к API: {e}")
         bot.reply_to(message, "Произошла ошибка при получении погоды. Попробуйте позже.")
@@ -136,9 +353,202 @@ def get_weather(message, city):
         print(f"Непредвиденная ошибка: {e}")
         bot.reply_to(message, "Произошла непредвиденная ошибка. Пожалуйста, попробуйте позже.")
 
+def create_forecast_pager(city, day_index, days_count):
+    """Создает кнопки листания прогноза по дням."""
+    markup = telebot.types.InlineKeyboardMarkup()
+    buttons = []
+    if day_index > 0 and pager_callback(day_index - 1, city):
+        buttons.append(telebot.types.InlineKeyboardButton("◀ Назад", callback_data=pager_callback(day_index - 1, city)))
+    if day_index < days_count - 1 and pager_callback(day_index + 1, city):
+        buttons.append(telebot.types.InlineKeyboardButton("Вперед ▶", callback_data=pager_callback(day_index + 1, city)))
+    markup.row(*buttons)
+    return markup
+
+def render_forecast_day(city, day_index):
+    """Возвращает текст и клавиатуру прогноза на выбранный день (из кэшированного прогноза)."""
+    forecast = get_forecast(city)
+    timezone = city_timezone(city, forecast.timezone)
+    days = daily_summaries(forecast, timezone)
+    day_index = max(0, min(day_index, len(days) - 1))
+    text = format_forecast_day(city, forecast, days, day_index, timezone)
+    return text, create_forecast_pager(city, day_index, len(days))
+
+def forecast_error_text(error):
+    """Возвращает текст ответа пользователю для ошибки при получении прогноза."""
+    if isinstance(error, CityNotFound):
+        return "Город не найден, попробуйте еще раз."
+    if isinstance(error, CircuitOpen):
+        return "Сервис погоды временно недоступен. Попробуйте через минуту."
+    if isinstance(error, RateLimited):
+        return "Слишком много запросов к сервису погоды. Попробуйте через минуту."
+    print(f"Ошибка при получении прогноза: {error}")
+    return "Произошла ошибка при получении прогноза. Попробуйте позже."
+
+@bot.message_handler(commands=['forecast'])
+def send_forecast(message):
+    """Отправляет прогноз по дням с кнопками листания."""
+    parts = message.text.split(maxsplit=1)
+    if len(parts) < 2:
+        bot.reply_to(message, "Укажите город, например: /forecast Москва")
+        return
+    city = gazetteer.canonical(parts[1])
+    try:
+        text, markup = render_forecast_day(city, 0)
+    except (CityNotFound, RateLimited, requests.exceptions.RequestException, KeyError, IndexError) as e:
+        bot.reply_to(message, forecast_error_text(e))
+        return
+    bot.send_message(message.chat.id, text, reply_markup=markup)
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith(CALLBACK_PREFIX))
+def callback_forecast_page(call):
+    """Показывает прогноз на другой день, редактируя сообщение."""
+    day_index, city = parse_pager_callback(call.data)
+    try:
+        text, markup = render_forecast_day(city, day_index)
+    except (CityNotFound, RateLimited, requests.exceptions.RequestException, KeyError, IndexError) as e:
+        bot.answer_callback_query(call.id, forecast_error_text(e))
+        return
+    try:
+        bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup)
+    except telebot.apihelper.ApiTelegramException:
+        pass  # Сообщение не изменилось (повторное нажатие)
+    bot.answer_callback_query(call.id)
+
+@bot.message_handler(commands=['subscribe'])
+def subscribe(message):
+    """Подписывает чат на ежедневный прогноз для города."""
+    parts = message.text.split(maxsplit=1)
+    parsed = parse_subscribe_args(parts[1] if len(parts) > 1 else "")
+    if parsed is None:
+        bot.reply_to(message, "Укажите город и время, например: /subscribe Москва 07:30")
+        return
+    city, local_time = parsed
+    city = gazetteer.canonical(city)
+    try:
+        forecast = get_forecast(city)  # Заодно проверяем, что город существует
+    except (CityNotFound, RateLimited, requests.exceptions.RequestException, KeyError, IndexError) as e:
+        bot.reply_to(message, forecast_error_text(e))
+        return
+    subscription_store.add(message.chat.id, city, local_time, city_timezone(city, forecast.timezone))
+    bot.reply_to(message, f"Готово! Каждый день в {local_time} (местное время) я буду присылать прогноз для города {city}.")
+
+@bot.message_handler(commands=['unsubscribe'])
+def unsubscribe(message):
+    """Отменяет подписку на город (или все подписки чата)."""
+    parts = message.text.split(maxsplit=1)
+    city = gazetteer.canonical(parts[1]) if len(parts) > 1 else None  # Подписка сохранена под каноническим названием
+    removed = subscription_store.remove(message.chat.id, city)
+    if removed:
+        bot.reply_to(message, "Подписка отменена." if city else f"Отменено подписок: {removed}.")
+    else:
+        bot.reply_to(message, "Подписок не найдено.")
+
+def deliver_subscriptions(utc_minute):
+    """Ставит в очередь рассылки прогнозы для подписок, наступивших в эту минуту.
+
+    Подписки сгруппированы по городу: прогноз каждого города запрашивается один раз.
+    """
+    for city, chat_ids in subscription_store.due(utc_minute).items():
+        try:
+            text, markup = render_forecast_day(city, 0)
+        except Exception as e:
+            print(f"Ошибка при подготовке рассылки для города {city}: {e}")
+            continue
+        for chat_id in chat_ids:
+            send_queue.put((chat_id, text, markup))
+
+def subscriptions_loop():
+    """Фоновый поток: раз в минуту рассылает прогнозы подписчикам."""
+    last_minute = None
+    while True:
+        time.sleep(60 - time.time() % 60)
+        minute = int(time.time() // 60)
+        # Если поток задержался, догоняем пропущенные минуты (но не больше пяти)
+        first = minute if last_minute is None else max(last_minute + 1, minute - 4)
+        try:
+            subscription_store.reschedule()  # Переход на летнее/зимнее время меняет минуту отправки по UTC
+        except Exception as e:
+            print(f"Ошибка при пересчете времени подписок: {e}")
+        for pending_minute in range(first, minute + 1):
+            try:
+                deliver_subscriptions(pending_minute % MINUTES_PER_DAY)
+            except Exception as e:
+                print(f"Ошибка при рассылке подписок: {e}")
+        last_minute = minute
+
+def send_worker():
+    """Фоновый поток: отправляет сообщения из очереди рассылки с учетом лимита Telegram."""
+    while True:
+        chat_id, text, markup = send_queue.get()
+        try:
+            send_limiter.acquire()
+            bot.send_message(chat_id, text, reply_markup=markup)
+        except telebot.apihelper.ApiTelegramException as e:
+            if e.error_code == 429:
+                time.sleep(e.result_json.get("parameters", {}).get("retry_after", 1))
+                send_queue.put((chat_id, text, markup))
+            elif e.error_code == 403:
+                subscription_store.remove(chat_id)  # Пользователь заблокировал бота
+            else:
+                print(f"Ошибка при отправке рассылки в чат {chat_id}: {e}")
+        except Exception as e:
+            print(f"Ошибка при отправке рассылки в чат {chat_id}: {e}")
+        finally:
+            send_queue.task_done()
+
+@bot.message_handler(commands=['stats'])
+def send_stats(message):
+    """Показывает расход квоты OpenWeatherMap и эффективность кэша (только чатам из STATS_CHAT_IDS)."""
+    if message.chat.id not in STATS_CHAT_IDS:
+        return  # Служебная статистика не для пользователей бота
+    quota = rate_limiter.stats()
+    current_stats = current_cache.stats()
+    forecast_stats = forecast_cache.stats()
+    circuit = circuit_breaker.stats()
+    text = (
+        f"Запросов к OpenWeatherMap сегодня: {quota['calls_today']}"
+        f"{' из ' + str(quota['daily_quota']) if quota['daily_quota'] else ''}\n"
+        f"Отклонено из-за лимита: {quota['throttled']}\n"
+        f"Кэш текущей погоды: {current_stats['hits']} попаданий, {current_stats['misses']} промахов\n"
+        f"Кэш прогнозов: {forecast_stats['hits']} попаданий, {forecast_stats['misses']} промахов\n"
+        f"Предохранитель: {'разомкнут' if circuit['open'] else 'замкнут'}, срабатываний: {circuit['trips']}"
+    )
+    bot.reply_to(message, text)
+
+def create_suggestions_keyboard(text, suggestions):
+    """Создает кнопки с вариантами исправления названия города."""
+    markup = telebot.types.InlineKeyboardMarkup()
+    for city in suggestions:
+        markup.row(telebot.types.InlineKeyboardButton(city.name, callback_data=city_callback(city.name)))
+    if city_callback(text):
+        markup.row(telebot.types.InlineKeyboardButton(f"Искать «{text}»", callback_data=city_callback(text)))
+    return markup
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith(CITY_CALLBACK_PREFIX))
+def callback_city_suggestion(call):
+    """Показывает погоду для города, выбранного из подсказок."""
+    bot.answer_callback_query(call.id)
+    get_weather(call.message, call.data[len(CITY_CALLBACK_PREFIX):])
+
 @bot.message_handler(func=lambda message: True)
 def handle_message(message):
-    get_weather(message, message.text)
+    text = (message.text or "").strip()
+    # Явно некорректный ввод не отправляем в API
+    if not looks_like_city(text):
+        bot.reply_to(message, "Это не похоже на название города. Напишите город, например: Москва")
+        return
+    known = gazetteer.get(text)
+    if known is not None:
+        get_weather(message, known.name)
+        return
+    # Возможная опечатка: предлагаем похожие города из справочника
+    suggestions = gazetteer.suggest(text)
+    if suggestions:
+        bot.reply_to(message, "Возможно, вы имели в виду:", reply_markup=create_suggestions_keyboard(text, suggestions))
+        return
+    get_weather(message, text)
 
 if __name__ == '__main__':
+    threading.Thread(target=subscriptions_loop, daemon=True).start()
+    threading.Thread(target=send_worker, daemon=True).start()
     bot.infinity_polling()
\ No newline at end of file
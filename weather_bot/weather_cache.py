@@ -0,0 +1,289 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict, namedtuple
+
+# Настройки кэша (значения по умолчанию, боты могут переопределить их через .env)
+CURRENT_WEATHER_TTL = 600  # Текущая погода у OpenWeatherMap обновляется примерно раз в 10 минут
+FORECAST_TTL = 1800  # Прогноз меняется реже
+CACHE_MAX_SIZE = 1000  # Максимальное количество городов в кэше
+GEOCODE_DB_PATH = 'db/geocode.db'  # Постоянный кэш координат городов
+GEOCODE_NEGATIVE_TTL = 3600  # Сколько помнить, что город не найден (защита от спама опечатками)
+
+# Координаты города; timezone - смещение от UTC в секундах (None, пока неизвестно)
+Place = namedtuple("Place", ["lat", "lon", "name", "timezone"])
+
+
+class CityNotFound(Exception):
+    """Город не найден геокодером OpenWeatherMap."""
+
+
+def normalize_city(city: str) -> str:
+    """Приводит название города к ключу кэша: без регистра и лишних пробелов."""
+    return " ".join(city.split()).casefold()
+
+
+class _Call:
+    """Запрос к API, который уже выполняется в другом потоке."""
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class TTLCache:
+    """Кэш с временем жизни записей и вытеснением давно не использованных (LRU).
+
+    Поддерживает объединение одновременных запросов (single-flight): если несколько
+    пользователей одновременно спрашивают один и тот же город, к API уйдет один запрос.
+    """
+    def __init__(self, ttl: float, maxsize: int = CACHE_MAX_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # ключ -> (значение, момент устаревания)
+        self._lock = threading.Lock()
+        self._calls = {}  # ключ -> _Call (для синхронного бота)
+        self._tasks = {}  # ключ -> asyncio.Task (для асинхронного бота)
+
+    def _fresh(self, key):
+        entry = self._data.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        self._data.move_to_end(key)
+        return entry[0]
+
+    def get(self, key):
+        """Возвращает свежее значение из кэша или None."""
+        with self._lock:
+            value = self._fresh(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def get_stale(self, key):
+        """Возвращает значение из кэша, даже если оно устарело (None, если записи нет)."""
+        with self._lock:
+            entry = self._data.get(key)
+            return entry[0] if entry is not None else None
+
+    def set(self, key, value):
+        """Сохраняет значение в кэш, вытесняя самую старую запись при переполнении."""
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def age(self, key):
+        """Сколько секунд назад запись была сохранена (None, если записи нет)."""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        return max(0, time.monotonic() - (entry[1] - self.ttl))
+
+    def expires_in(self, key) -> float:
+        """Сколько секунд осталось до устаревания записи (0, если записи нет)."""
+        entry = self._data.get(key)
+        if entry is None:
+            return 0
+        return max(0, entry[1] - time.monotonic())
+
+    def stats(self) -> dict:
+        """Возвращает счетчики попаданий и промахов."""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data)}
+
+    def get_or_fetch(self, key, fetch):
+        """Возвращает значение из кэша или вызывает fetch() (один раз на все потоки)."""
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            value = self._fresh(key)  # Значение могло появиться, пока мы ждали блокировку
+            if value is not None:
+                return value
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            # Кто-то уже запрашивает этот город, ждем его результат
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fetch()
+            self.set(key, call.result)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    async def get_or_fetch_async(self, key, fetch):
+        """Асинхронный вариант get_or_fetch: fetch() должна возвращать корутину."""
+        value = self.get(key)
+        if value is not None:
+            return value
+        return await self.refresh_async(key, fetch)
+
+    async def refresh_async(self, key, fetch):
+        """Принудительно обновляет значение (для фонового прогрева кэша)."""
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_and_store(key, fetch))
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._forget_task(key, t))
+        # shield: отмена одного ожидающего не должна отменять запрос для остальных
+        return await asyncio.shield(task)
+
+    def _forget_task(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            task.exception()  # Помечаем ошибку как обработанную, даже если все ожидающие отменены
+
+    async def _fetch_and_store(self, key, fetch):
+        value = await fetch()
+        self.set(key, value)
+        return value
+
+
+class HotCities:
+    """Список «горячих» городов для прогрева кэша.
+
+    Состоит из заданных в настройках городов и самых запрашиваемых городов за последнее время.
+    Счетчики запросов уменьшаются вдвое при каждом пересчете, чтобы список подстраивался под нагрузку.
+    """
+    def __init__(self, cities, max_size: int = 20):
+        self.pinned = {normalize_city(city): city for city in cities}
+        self.max_size = max_size
+        self._counts = Counter()
+        self._names = {}  # ключ -> название города, как его писали пользователи
+
+    def record(self, city: str):
+        """Учитывает запрос города пользователем."""
+        key = normalize_city(city)
+        self._counts[key] += 1
+        self._names[key] = city
+
+    def current(self) -> dict:
+        """Возвращает {ключ: название} для прогрева и «состаривает» счетчики."""
+        hot = dict(self.pinned)
+        for key, _ in self._counts.most_common():
+            if len(hot) >= self.max_size:
+                break
+            hot.setdefault(key, self._names[key])
+
+        for key in list(self._counts):
+            self._counts[key] //= 2
+            if not self._counts[key]:
+                del self._counts[key]
+                del self._names[key]
+        return hot
+
+
+class GeocodeStore:
+    """Постоянное хранилище координат городов в SQLite.
+
+    Все записи загружаются в память при старте, поэтому повторные запросы не обращаются
+    ни к геокодеру, ни к диску. Отрицательные результаты хранятся ограниченное время.
+    """
+    def __init__(self, path: str = GEOCODE_DB_PATH, negative_ttl: float = GEOCODE_NEGATIVE_TTL):
+        self.negative_ttl = negative_ttl
+        self._places = {}  # ключ -> Place
+        self._not_found = {}  # ключ -> момент (time.time()), когда город не нашелся
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS geocode (
+                key        TEXT PRIMARY KEY,
+                lat        REAL,
+                lon        REAL,
+                name       TEXT,
+                timezone   INTEGER,
+                found      INTEGER NOT NULL,
+                updated_at REAL    NOT NULL
+            )
+        ''')
+        self._conn.commit()
+        self._load()
+
+    def _load(self):
+        """Загружает сохраненные координаты в память, пропуская устаревшие отрицательные записи."""
+        now = time.time()
+        for key, lat, lon, name, timezone, found, updated_at in self._conn.execute("SELECT * FROM geocode"):
+            if found:
+                self._places[key] = Place(lat, lon, name, timezone)
+            elif now - updated_at < self.negative_ttl:
+                self._not_found[key] = updated_at
+
+    def get(self, key):
+        """Возвращает Place, None (город еще не запрашивался) или бросает CityNotFound."""
+        place = self._places.get(key)
+        if place is not None:
+            return place
+        not_found_at = self._not_found.get(key)
+        if not_found_at is not None:
+            if time.time() - not_found_at < self.negative_ttl:
+                raise CityNotFound(key)
+            self._not_found.pop(key, None)
+        return None
+
+    def put(self, key, place: Place):
+        """Запоминает координаты города."""
+        with self._lock:
+            self._places[key] = place
+            self._not_found.pop(key, None)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?, 1, ?)",
+                (key, place.lat, place.lon, place.name, place.timezone, time.time())
+            )
+            self._conn.commit()
+
+    def put_not_found(self, key):
+        """Запоминает, что город не найден."""
+        if key in self._places:
+            return  # Координаты уже известны, разовая ошибка API их не отменяет
+        now = time.time()
+        with self._lock:
+            self._not_found[key] = now
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode (key, found, updated_at) VALUES (?, 0, ?)",
+                (key, now)
+            )
+            self._conn.commit()
+
+    def set_timezone(self, key, timezone: int):
+        """Сохраняет смещение часового пояса города, если оно изменилось."""
+        place = self._places.get(key)
+        if place is None or place.timezone == timezone:
+            return
+        self.put(key, place._replace(timezone=timezone))
+
+    def close(self):
+        self._conn.close()
+
+
+def place_from_geo(geo_data) -> Place:
+    """Строит Place из ответа /geo/1.0/direct (бросает CityNotFound для пустого ответа)."""
+    if not geo_data:
+        raise CityNotFound()
+    item = geo_data[0]
+    name = item.get("local_names", {}).get("ru", item["name"])
+    return Place(item["lat"], item["lon"], name, None)
@@ -0,0 +1,83 @@
+"""Прогноз по дням: агрегаты (мин/макс/средняя температура, осадки) из кэшированного прогноза города."""
+from datetime import datetime
+
+from weather_parse import Forecast
+
+WEEKDAYS = ["пн", "вт", "ср", "чт", "пт", "сб", "вс"]
+CALLBACK_PREFIX = "forecast_"  # callback_data кнопок листания: forecast_<номер дня>_<город>
+CALLBACK_DATA_LIMIT = 64  # Ограничение Telegram на длину callback_data в байтах
+
+# Группы кодов погоды OpenWeatherMap: https://openweathermap.org/weather-conditions
+_CODE_LABELS = {
+    2: "⛈ гроза",
+    3: "🌦 морось",
+    5: "🌧 дождь",
+    6: "🌨 снег",
+    7: "🌫 туман",
+}
+
+
+def weather_label(code: int) -> str:
+    """Возвращает короткую подпись для кода погоды."""
+    if code == 800:
+        return "☀️ ясно"
+    if code > 800:
+        return "☁️ облачно"
+    return _CODE_LABELS.get(code // 100, "")
+
+
+def pager_callback(day_index: int, city: str):
+    """Возвращает callback_data для кнопки листания или None, если город не помещается в лимит Telegram."""
+    data = f"{CALLBACK_PREFIX}{day_index}_{city}"
+    return data if len(data.encode()) <= CALLBACK_DATA_LIMIT else None
+
+
+def parse_pager_callback(data: str):
+    """Разбирает callback_data кнопки листания в (номер дня, город)."""
+    day_index, city = data[len(CALLBACK_PREFIX):].split("_", 1)
+    return int(day_index), city
+
+
+class DaySummary:
+    """Агрегаты прогноза за один день (местное время города)."""
+    __slots__ = ("date", "start", "end", "temp_min", "temp_max", "temp_avg", "precipitation")
+
+    def __init__(self, date, start, end, temps, precipitation):
+        self.date = date
+        self.start = start  # Индексы слотов дня в столбцах прогноза: [start, end)
+        self.end = end
+        self.temp_min = min(temps)
+        self.temp_max = max(temps)
+        self.temp_avg = sum(temps) / len(temps)
+        self.precipitation = sum(precipitation)
+
+
+def daily_summaries(forecast: Forecast, tz) -> list:
+    """Группирует 3-часовые слоты прогноза по дням в часовом поясе города."""
+    days = []
+    start, current_date = 0, None
+    for i, timestamp in enumerate(forecast.times):
+        date = datetime.fromtimestamp(timestamp, tz).date()
+        if date != current_date:
+            if current_date is not None:
+                days.append(DaySummary(current_date, start, i, forecast.temps[start:i], forecast.precipitation[start:i]))
+            start, current_date = i, date
+    if current_date is not None:
+        end = len(forecast.times)
+        days.append(DaySummary(current_date, start, end, forecast.temps[start:end], forecast.precipitation[start:end]))
+    return days
+
+
+def format_forecast_day(city: str, forecast: Forecast, days: list, day_index: int, tz) -> str:
+    """Формирует текст прогноза на один день (из daily_summaries) с почасовой разбивкой."""
+    day = days[day_index]
+    lines = [
+        f"Прогноз для города {city} на {day.date:%d.%m} ({WEEKDAYS[day.date.weekday()]}), день {day_index + 1} из {len(days)}:",
+        f"Температура: от {day.temp_min:.0f} до {day.temp_max:.0f}°C, в среднем {day.temp_avg:.0f}°C",
+        f"Осадки: {day.precipitation:.1f} мм",
+        "",
+    ]
+    for i in range(day.start, day.end):
+        time_local = datetime.fromtimestamp(forecast.times[i], tz).strftime('%H:%M')
+        lines.append(f"{time_local}  {forecast.temps[i]:+.0f}°C  {weather_label(forecast.codes[i])}")
+    return "\n".join(lines)
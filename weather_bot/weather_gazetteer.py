@@ -0,0 +1,140 @@
+"""Локальный справочник городов (gazetteer) с нечетким поиском по триграммам.
+
+Справочник загружается при старте из CSV-файла и позволяет без запросов к API:
+приводить название к каноническому виду, получать координаты и предлагать исправления опечаток.
+"""
+import csv
+import re
+from bisect import bisect_left
+from collections import Counter
+
+from weather_cache import Place, normalize_city
+from weather_forecast import CALLBACK_DATA_LIMIT
+
+GAZETTEER_PATH = 'data/cities.csv'  # Справочник городов: name, lat, lon, timezone, aliases
+CITY_CALLBACK_PREFIX = "weather_city_"  # callback_data кнопок с подсказками: weather_city_<город>
+MAX_CITY_NAME_LENGTH = 60
+SUGGESTION_SIMILARITY = 0.45  # Минимальная похожесть (коэффициент Дайса по триграммам) для подсказки
+
+# Название города: слова из букв, разделенные пробелами, дефисами, апострофами или точками
+_CITY_NAME_RE = re.compile(r"^[^\W\d_]+(?:[\s'’.\-]+[^\W\d_]+)*\.?$")
+
+
+def looks_like_city(text: str) -> bool:
+    """Отсекает запросы, которые точно не являются названием города (цифры, ссылки, эмодзи...)."""
+    text = text.strip()
+    return 0 < len(text) <= MAX_CITY_NAME_LENGTH and _CITY_NAME_RE.match(text) is not None
+
+
+def city_callback(city: str):
+    """Возвращает callback_data для кнопки с городом или None, если город не помещается в лимит Telegram."""
+    data = f"{CITY_CALLBACK_PREFIX}{city}"
+    return data if len(data.encode()) <= CALLBACK_DATA_LIMIT else None
+
+
+def fold(text: str) -> str:
+    """Ключ поиска: без регистра, «ё» -> «е», дефисы и лишние пробелы -> один пробел."""
+    return " ".join(normalize_city(text).replace("ё", "е").replace("-", " ").split())
+
+
+def trigrams(key: str) -> set:
+    """Триграммы ключа (с границами слова), например "омск" -> {"  о", " ом", "омс", "мск", "ск "}."""
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class GazetteerCity:
+    """Город из справочника."""
+    __slots__ = ("name", "lat", "lon", "timezone")
+
+    def __init__(self, name, lat, lon, timezone):
+        self.name = name  # Каноническое название
+        self.lat = lat
+        self.lon = lon
+        self.timezone = timezone  # Название часового пояса (IANA), например Europe/Moscow
+
+    @property
+    def place(self) -> Place:
+        return Place(self.lat, self.lon, self.name, None)
+
+
+class Gazetteer:
+    """Справочник городов с индексом по названиям и триграммам."""
+    def __init__(self, cities):
+        """cities - пары (GazetteerCity, [название, синоним, ...])."""
+        self.cities = []
+        self._by_key = {}  # ключ (название или синоним) -> GazetteerCity
+        self._keys = []  # все ключи, индекс в списке используется в триграммном индексе
+        self._sizes = []  # число триграмм каждого ключа
+        self._index = {}  # триграмма -> [номер ключа, ...]
+
+        for city, names in cities:
+            self.cities.append(city)
+            for name in names:
+                key = fold(name)
+                if key in self._by_key:
+                    continue
+                self._by_key[key] = city
+                key_id = len(self._keys)
+                self._keys.append(key)
+                key_trigrams = trigrams(key)
+                self._sizes.append(len(key_trigrams))
+                for trigram in key_trigrams:
+                    self._index.setdefault(trigram, []).append(key_id)
+        self._sorted_keys = sorted(self._by_key)  # Для поиска по префиксу (автодополнение)
+
+    @classmethod
+    def load(cls, path: str = GAZETTEER_PATH):
+        """Загружает справочник из CSV (name, lat, lon, timezone, aliases через «|»)."""
+        cities = []
+        with open(path, encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                city = GazetteerCity(row["name"], float(row["lat"]), float(row["lon"]), row["timezone"])
+                aliases = [alias for alias in row.get("aliases", "").split("|") if alias]
+                cities.append((city, [city.name] + aliases))
+        return cls(cities)
+
+    def get(self, text: str):
+        """Точный поиск по названию или синониму (без учета регистра, «ё» и дефисов)."""
+        return self._by_key.get(fold(text))
+
+    def canonical(self, text: str) -> str:
+        """Возвращает каноническое название города или сам текст, если города нет в справочнике."""
+        city = self.get(text)
+        return city.name if city is not None else text.strip()
+
+    def complete(self, prefix: str, limit: int = 5) -> list:
+        """Возвращает до limit городов, название или синоним которых начинается с prefix."""
+        prefix = fold(prefix)
+        if not prefix:
+            return []
+        cities = []
+        for i in range(bisect_left(self._sorted_keys, prefix), len(self._sorted_keys)):
+            key = self._sorted_keys[i]
+            if not key.startswith(prefix):
+                break
+            city = self._by_key[key]
+            if city not in cities:
+                cities.append(city)
+                if len(cities) == limit:
+                    break
+        return cities
+
+    def suggest(self, text: str, limit: int = 3, min_similarity: float = SUGGESTION_SIMILARITY) -> list:
+        """Возвращает до limit городов, похожих на text, от самого похожего."""
+        key = fold(text)
+        query = trigrams(key)
+        common = Counter()
+        for trigram in query:
+            for key_id in self._index.get(trigram, ()):
+                common[key_id] += 1
+
+        scored = {}
+        for key_id, count in common.items():
+            similarity = 2 * count / (len(query) + self._sizes[key_id])
+            if similarity < min_similarity:
+                continue
+            city = self._by_key[self._keys[key_id]]
+            if similarity > scored.get(city, 0):
+                scored[city] = similarity
+        return sorted(scored, key=scored.get, reverse=True)[:limit]
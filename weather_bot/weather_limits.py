@@ -0,0 +1,143 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timezone
+
+# Ограничения тарифа OpenWeatherMap (значения по умолчанию, боты могут переопределить их через .env)
+CALLS_PER_MINUTE = 60  # Бесплатный тариф: 60 запросов в минуту
+MAX_QUEUE_WAIT = 5  # Сколько секунд запрос может ждать своей очереди
+DAILY_QUOTA = 0  # Лимит запросов в сутки (0 - без ограничения)
+
+# Предохранитель (circuit breaker) для запросов к OpenWeatherMap
+FAILURE_THRESHOLD = 5  # Сколько ошибок подряд размыкают предохранитель
+SLOW_CALL_THRESHOLD = 4  # Запрос дольше этого (с) считается ошибкой
+RESET_TIMEOUT = 30  # Через сколько секунд после размыкания пропустить пробный запрос
+
+
+class RateLimited(Exception):
+    """Запрос к API не выполнен: исчерпан лимит запросов."""
+
+
+class CircuitOpen(RateLimited):
+    """Запрос к API не выполнен: сервис недоступен, предохранитель разомкнут."""
+
+
+class RateLimiter:
+    """Ограничитель частоты запросов по алгоритму «ведро с токенами» (token bucket).
+
+    Если токенов нет, запрос встает в очередь (резервирует будущий токен) и ждет не дольше
+    max_wait секунд; иначе бросается RateLimited. Также считает запросы за текущие сутки (UTC).
+    """
+    def __init__(self, calls_per_minute: float = CALLS_PER_MINUTE, max_wait: float = MAX_QUEUE_WAIT,
+                 daily_quota: int = DAILY_QUOTA, burst: float = None):
+        self.rate = calls_per_minute / 60  # Токенов в секунду
+        self.capacity = burst or max(1, calls_per_minute / 6)  # Разрешаем всплеск в 10 секунд трафика
+        self.max_wait = max_wait
+        self.daily_quota = daily_quota
+        self.tokens = self.capacity
+        self.throttled = 0  # Сколько запросов пришлось отклонить
+        self.calls_today = 0
+        self._day = self._today()
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _today():
+        return datetime.now(timezone.utc).date()
+
+    def _reserve(self) -> float:
+        """Резервирует токен и возвращает, сколько секунд нужно подождать."""
+        with self._lock:
+            today = self._today()
+            if today != self._day:
+                self._day = today
+                self.calls_today = 0
+            if self.daily_quota and self.calls_today >= self.daily_quota:
+                self.throttled += 1
+                raise RateLimited("Исчерпан суточный лимит запросов")
+
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            wait = 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+            if wait > self.max_wait:
+                self.throttled += 1
+                raise RateLimited("Превышен лимит запросов в минуту")
+            self.tokens -= 1  # Может уйти в минус: это очередь из уже зарезервированных запросов
+            self.calls_today += 1
+            return wait
+
+    def acquire(self):
+        """Ждет разрешения на запрос (для синхронного бота)."""
+        wait = self._reserve()
+        if wait:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """Ждет разрешения на запрос, не блокируя цикл событий."""
+        wait = self._reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+    def stats(self) -> dict:
+        """Возвращает расход квоты за сутки и число отклоненных запросов."""
+        return {
+            "calls_today": self.calls_today,
+            "daily_quota": self.daily_quota,
+            "throttled": self.throttled,
+        }
+
+
+class CircuitBreaker:
+    """Предохранитель для запросов к внешнему API.
+
+    После failure_threshold ошибок (или слишком медленных ответов) подряд размыкается: запросы
+    сразу завершаются CircuitOpen, не дожидаясь таймаутов. Раз в reset_timeout секунд пропускает
+    один пробный запрос; если он успешен, предохранитель замыкается.
+    """
+    def __init__(self, failure_threshold: int = FAILURE_THRESHOLD, slow_call_threshold: float = SLOW_CALL_THRESHOLD,
+                 reset_timeout: float = RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.slow_call_threshold = slow_call_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0  # Ошибок подряд
+        self.trips = 0  # Сколько раз предохранитель размыкался
+        self._opened_at = None  # Момент размыкания (или последнего пробного запроса); None - замкнут
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def before_call(self):
+        """Проверяет, можно ли выполнить запрос (бросает CircuitOpen, если нельзя)."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            now = time.monotonic()
+            if now - self._opened_at < self.reset_timeout:
+                raise CircuitOpen("Сервис недоступен, запросы временно не выполняются")
+            self._opened_at = now  # Пропускаем пробный запрос, следующий - не раньше чем через reset_timeout
+
+    def record_success(self, duration: float):
+        """Учитывает успешный запрос длительностью duration секунд."""
+        if duration > self.slow_call_threshold:
+            self.record_failure()
+            return
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        """Учитывает ошибку запроса (сетевую, таймаут или 5xx)."""
+        with self._lock:
+            self.failures += 1
+            if self._opened_at is not None or self.failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    self.trips += 1
+                self._opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        """Возвращает состояние предохранителя."""
+        return {"open": self.is_open, "failures": self.failures, "trips": self.trips}
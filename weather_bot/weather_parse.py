@@ -0,0 +1,93 @@
+"""Разбор ответов OpenWeatherMap в компактные записи.
+
+Из ответа берутся только поля, которые нужны для сообщения бота; сырые словари сразу
+отбрасываются, а в кэше хранятся записи со __slots__ (без __dict__ на каждый объект).
+"""
+from array import array
+
+# Сколько ближайших слотов прогноза хранить: первый нужен для ответа,
+# второй - для стратегии "forecast", где первый слот заменяет текущую погоду
+FORECAST_SLOTS = 2
+
+
+class Conditions:
+    """Погодные условия: текущие или для одного 3-часового слота прогноза."""
+    __slots__ = ("dt", "temp", "feels_like", "description", "pressure", "humidity", "wind_speed", "visibility", "timezone")
+
+    def __init__(self, dt, temp, feels_like, description, pressure, humidity, wind_speed, visibility=None, timezone=None):
+        self.dt = dt  # Unix-время (UTC)
+        self.temp = temp
+        self.feels_like = feels_like
+        self.description = description
+        self.pressure = pressure  # гПа
+        self.humidity = humidity
+        self.wind_speed = wind_speed
+        self.visibility = visibility  # Может отсутствовать в ответе API
+        self.timezone = timezone  # Смещение от UTC в секундах
+
+
+class Forecast:
+    """Прогноз на 5 дней для одного города.
+
+    Ближайшие слоты хранятся целиком (для ответа на сообщение), а весь прогноз - в виде
+    столбцов-массивов: время, температура, код погоды и осадки для каждого 3-часового слота.
+    """
+    __slots__ = ("slots", "timezone", "times", "temps", "codes", "precipitation")
+
+    def __init__(self, slots, timezone=None, times=None, temps=None, codes=None, precipitation=None):
+        self.slots = slots
+        self.timezone = timezone  # Смещение от UTC в секундах
+        self.times = times if times is not None else array("q")  # Unix-время (UTC)
+        self.temps = temps if temps is not None else array("f")  # °C
+        self.codes = codes if codes is not None else array("H")  # Код погоды OpenWeatherMap (weather[0].id)
+        self.precipitation = precipitation if precipitation is not None else array("f")  # Дождь + снег за 3 часа, мм
+
+
+def _conditions(item, timezone=None) -> Conditions:
+    main = item["main"]
+    return Conditions(
+        item["dt"],
+        main["temp"],
+        main["feels_like"],
+        item["weather"][0]["description"],
+        main["pressure"],
+        main["humidity"],
+        item["wind"]["speed"],
+        item.get("visibility"),
+        timezone,
+    )
+
+
+def parse_current(current_data) -> Conditions:
+    """Разбирает ответ /data/2.5/weather."""
+    return _conditions(current_data, current_data.get("timezone"))
+
+
+def parse_forecast(forecast_data, max_slots: int = FORECAST_SLOTS) -> Forecast:
+    """Разбирает ответ /data/2.5/forecast: ближайшие слоты целиком, остальное - столбцами."""
+    items = forecast_data["list"]
+    timezone = forecast_data.get("city", {}).get("timezone")
+    return Forecast(
+        tuple(_conditions(item) for item in items[:max_slots]),
+        timezone,
+        array("q", (item["dt"] for item in items)),
+        array("f", (item["main"]["temp"] for item in items)),
+        array("H", (item["weather"][0]["id"] for item in items)),
+        array("f", (item.get("rain", {}).get("3h", 0) + item.get("snow", {}).get("3h", 0) for item in items)),
+    )
+
+
+def split_forecast(forecast: Forecast):
+    """Делит прогноз на «текущую погоду» (ближайший слот) и прогноз (следующие слоты).
+
+    Используется стратегией "forecast": вместо трех запросов к API бот делает один.
+    """
+    first = forecast.slots[0]
+    current = Conditions(
+        first.dt, first.temp, first.feels_like, first.description, first.pressure,
+        first.humidity, first.wind_speed, first.visibility, forecast.timezone,
+    )
+    return current, Forecast(
+        forecast.slots[1:], forecast.timezone,
+        forecast.times[1:], forecast.temps[1:], forecast.codes[1:], forecast.precipitation[1:],
+    )
@@ -0,0 +1,161 @@
+import os
+import re
+import sqlite3
+import threading
+from collections import defaultdict
+
+import pytz
+
+from weather_cache import normalize_city
+from weather_time import CITY_TIMEZONES, utc_offset_seconds
+
+SUBSCRIPTIONS_DB_PATH = 'db/subscriptions.db'  # Подписки на ежедневный прогноз
+TELEGRAM_MESSAGES_PER_SECOND = 30  # Общий лимит Telegram на рассылку сообщений
+
+MINUTES_PER_DAY = 24 * 60
+_TIME_RE = re.compile(r"^([01]?\d|2[0-3]):([0-5]\d)$")
+
+
+def parse_subscribe_args(args: str):
+    """Разбирает аргументы команды /subscribe "<город> <ЧЧ:ММ>" в (город, "ЧЧ:ММ") или None."""
+    parts = (args or "").rsplit(maxsplit=1)
+    if len(parts) != 2:
+        return None
+    city, time_text = parts[0].strip(), parts[1]
+    match = _TIME_RE.match(time_text)
+    if not city or not match:
+        return None
+    return city, f"{int(match.group(1)):02d}:{match.group(2)}"
+
+
+def to_utc_minute(local_time: str, utc_offset: int) -> int:
+    """Переводит местное время "ЧЧ:ММ" в минуту суток по UTC (0..1439)."""
+    hours, minutes = map(int, local_time.split(":"))
+    return (hours * 60 + minutes - utc_offset // 60) % MINUTES_PER_DAY
+
+
+class SubscriptionStore:
+    """Подписки на ежедневный прогноз в SQLite.
+
+    Для каждой подписки хранится минута суток по UTC, в которую ее нужно отправить, поэтому
+    планировщик раз в минуту выбирает только наступившие подписки по индексу. Вместе с ней
+    хранятся часовой пояс города и смещение, по которому минута посчитана: при переходе на
+    летнее или зимнее время reschedule() пересчитывает минуту, и прогноз приходит в то же местное время.
+    """
+    def __init__(self, path: str = SUBSCRIPTIONS_DB_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS subscriptions (
+                chat_id    INTEGER NOT NULL,
+                city_key   TEXT    NOT NULL,
+                city       TEXT    NOT NULL,
+                local_time TEXT    NOT NULL,
+                utc_minute INTEGER NOT NULL,
+                zone       TEXT,
+                utc_offset INTEGER,
+                PRIMARY KEY (chat_id, city_key)
+            );
+        ''')
+        self._add_zone_columns()
+        self._conn.executescript('''
+            CREATE INDEX IF NOT EXISTS subscriptions_utc_minute ON subscriptions (utc_minute);
+            CREATE INDEX IF NOT EXISTS subscriptions_zone ON subscriptions (zone, utc_offset);
+        ''')
+        self._conn.commit()
+
+    def _add_zone_columns(self):
+        """Добавляет столбцы часового пояса в базу, созданную до их появления.
+
+        Пояс известных городов заполняется из индекса weather_time; смещение остается пустым,
+        поэтому первый вызов reschedule() пересчитает минуту отправки таких подписок.
+        """
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(subscriptions)")}
+        if "zone" in columns:
+            return
+        self._conn.execute("ALTER TABLE subscriptions ADD COLUMN zone TEXT")
+        self._conn.execute("ALTER TABLE subscriptions ADD COLUMN utc_offset INTEGER")
+        city_keys = [row[0] for row in self._conn.execute("SELECT DISTINCT city_key FROM subscriptions")]
+        self._conn.executemany(
+            "UPDATE subscriptions SET zone = ? WHERE city_key = ?",
+            [(CITY_TIMEZONES[key].zone, key) for key in city_keys if key in CITY_TIMEZONES]
+        )
+
+    def add(self, chat_id: int, city: str, local_time: str, tz):
+        """Добавляет подписку (или меняет время существующей подписки на этот город).
+
+        tz - часовой пояс города (см. weather_time.city_timezone). Для поясов pytz минута отправки
+        пересчитывается при смене смещения, фиксированное смещение не меняется.
+        """
+        utc_offset = utc_offset_seconds(tz)
+        with self._lock:
+            self._conn.execute(
+                '''INSERT OR REPLACE INTO subscriptions (chat_id, city_key, city, local_time, utc_minute, zone, utc_offset)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                (chat_id, normalize_city(city), city, local_time, to_utc_minute(local_time, utc_offset),
+                 getattr(tz, "zone", None), utc_offset)
+            )
+            self._conn.commit()
+
+    def reschedule(self) -> int:
+        """Пересчитывает минуту отправки подписок, у часового пояса которых сменилось смещение от UTC.
+
+        Вызывается планировщиком перед каждой рассылкой; без перехода на летнее время это один
+        запрос по индексу. Возвращает число перенесенных подписок.
+        """
+        with self._lock:
+            stored = self._conn.execute(
+                "SELECT DISTINCT zone, utc_offset FROM subscriptions WHERE zone IS NOT NULL"
+            ).fetchall()
+            moved = 0
+            for zone, stored_offset in stored:
+                try:
+                    offset = utc_offset_seconds(pytz.timezone(zone))
+                except pytz.UnknownTimeZoneError:
+                    continue
+                if offset == stored_offset:
+                    continue
+                rows = self._conn.execute(
+                    "SELECT rowid, local_time FROM subscriptions WHERE zone = ? AND utc_offset IS ?", (zone, stored_offset)
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE subscriptions SET utc_minute = ?, utc_offset = ? WHERE rowid = ?",
+                    [(to_utc_minute(local_time, offset), offset, rowid) for rowid, local_time in rows]
+                )
+                moved += len(rows)
+            if moved:
+                self._conn.commit()
+            return moved
+
+    def remove(self, chat_id: int, city: str = None) -> int:
+        """Удаляет подписку на город (или все подписки чата) и возвращает число удаленных."""
+        with self._lock:
+            if city is None:
+                cursor = self._conn.execute("DELETE FROM subscriptions WHERE chat_id = ?", (chat_id,))
+            else:
+                cursor = self._conn.execute(
+                    "DELETE FROM subscriptions WHERE chat_id = ? AND city_key = ?", (chat_id, normalize_city(city))
+                )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def due(self, utc_minute: int) -> dict:
+        """Возвращает подписки, которые нужно отправить в эту минуту, сгруппированные по городу.
+
+        Результат: {название города: [chat_id, ...]}, по одному элементу на город, чтобы
+        прогноз для каждого города запрашивался один раз.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT city_key, city, chat_id FROM subscriptions WHERE utc_minute = ?", (utc_minute,)
+            ).fetchall()
+        names = {}
+        by_city = defaultdict(list)
+        for city_key, city, chat_id in rows:
+            by_city[names.setdefault(city_key, city)].append(chat_id)
+        return by_city
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+import pytz
+
+from weather_cache import normalize_city
+
+# Часовые пояса известных городов (для остальных используется смещение, которое возвращает OpenWeatherMap)
+_CITY_ZONES = {
+    'Europe/Moscow': ["Москва", "Санкт-Петербург", "Казань", "Нижний Новгород", "Ростов-на-Дону"],
+    'Europe/Minsk': ["Минск"],
+    'Asia/Novosibirsk': ["Новосибирск"],
+    'Asia/Yekaterinburg': ["Екатеринбург", "Челябинск"],
+    'Asia/Omsk': ["Омск"],
+    'Europe/Samara': ["Самара"],
+}
+
+# Индекс "нормализованное название города -> tzinfo", строится один раз при импорте
+CITY_TIMEZONES = {
+    normalize_city(city): pytz.timezone(zone)
+    for zone, cities in _CITY_ZONES.items()
+    for city in cities
+}
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+@lru_cache(maxsize=64)
+def _fixed_offset(offset_seconds: int):
+    return timezone(timedelta(seconds=offset_seconds))
+
+
+def register_city_timezone(city: str, zone: str):
+    """Добавляет часовой пояс города в индекс (не заменяя уже известный)."""
+    CITY_TIMEZONES.setdefault(normalize_city(city), pytz.timezone(zone))
+
+
+def city_timezone(city: str, utc_offset=None):
+    """Возвращает часовой пояс города: из индекса, по смещению от OpenWeatherMap или UTC."""
+    tz = CITY_TIMEZONES.get(normalize_city(city))
+    if tz is not None:
+        return tz
+    if utc_offset is not None:
+        return _fixed_offset(utc_offset)
+    return pytz.utc
+
+
+def format_local_time(timestamp: int, tz) -> str:
+    """Переводит Unix-время (поле dt в ответах OpenWeatherMap) в строку местного времени."""
+    return datetime.fromtimestamp(timestamp, tz).strftime(TIME_FORMAT)
+
+
+def utc_offset_seconds(tz) -> int:
+    """Возвращает текущее смещение часового пояса от UTC в секундах."""
+    return int(datetime.now(tz).utcoffset().total_seconds())
+
+
+def format_age(seconds: float) -> str:
+    """Возвращает возраст данных словами, например "5 мин" или "2 ч 10 мин"."""
+    minutes = int(seconds // 60)
+    if minutes < 1:
+        return "меньше минуты"
+    if minutes < 60:
+        return f"{minutes} мин"
+    return f"{minutes // 60} ч {minutes % 60} мин"